@@ -4,100 +4,308 @@ Database Manager per la sincronizzazione Nextcloud
 Gestisce tutte le operazioni sul database SQLite locale
 """
 
+import os
 import sqlite3
-from pathlib import Path
+import threading
 
 class DatabaseManager:
+    # PRAGMA applicati una sola volta all'apertura della connessione. Il database è uno
+    # storico ricostruibile: con WAL, synchronous=NORMAL non lo corrompe e al più perde
+    # le ultime transazioni in caso di crash del sistema (i file relativi vengono rielaborati)
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-65536",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA busy_timeout=60000",
+    )
+    
+    # Numero di righe accumulate prima di scriverle in un'unica transazione
+    FLUSH_EVERY = 500
+    
+    # Versione dello schema, salvata in PRAGMA user_version
+    SCHEMA_VERSION = 6
+    
+    # Numero massimo di parametri per singola clausola IN
+    MAX_QUERY_PARAMS = 500
+    
+    # Statement di inserimento usati per le scritture in blocco
+    INSERT_TRANSFERRED_FILE = '''
+        INSERT INTO transferred_files 
+        (sync_id, source_file, dest_file, file_hash, file_size, is_duplicate, processing_status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    INSERT_ERROR = '''
+        INSERT INTO sync_errors (sync_id, error_message, file_path)
+        VALUES (?, ?, ?)
+    '''
+    UPSERT_REMOTE_HASH = '''
+        INSERT OR REPLACE INTO remote_hashes (file_hash, remote_path)
+        VALUES (?, ?)
+    '''
+    UPSERT_REMOTE_INDEX = '''
+        INSERT OR REPLACE INTO remote_file_index (dest_path, algorithm, remote_path, size, mtime, file_hash)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    UPSERT_FILE_HASH = '''
+        INSERT OR REPLACE INTO file_hash_cache (dev, ino, algorithm, size, mtime_ns, file_hash)
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    
+    # Statement di aggiornamento dei report, riusati dalla cache di sqlite3
+    UPDATE_SYNC_REPORT = '''
+        UPDATE sync_reports SET
+            files_transferred = ?,
+            duplicates_found = ?,
+            duplicates_renamed = ?,
+            errors_count = ?,
+            skipped_files = ?,
+            already_processed = ?,
+            total_size_bytes = ?,
+            duration_seconds = ?,
+            status = ?
+        WHERE id = ?
+    '''
+    UPDATE_SYNC_STATUS = "UPDATE sync_reports SET status = ? WHERE id = ?"
+    
     def __init__(self, db_path="nextcloud_sync.db"):
         self.db_path = db_path
+        
+        # Connessione unica riutilizzata da tutti i metodi (autocommit)
+        self.conn = sqlite3.connect(
+            db_path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        self._lock = threading.Lock()
+        for pragma in self.PRAGMAS:
+            self.conn.execute(pragma)
+        
+        # Righe in attesa di essere scritte in blocco
+        self._pending_files = []
+        self._pending_errors = []
+        self._pending_hashes = []
+        self._pending_remote_hashes = []
+        self._pending_remote_index = []
+        
         self.init_database()
+        
+        # Connessione di sola lettura per i report: non contende il lock di scrittura
+        if db_path == ':memory:':
+            self.read_conn, self._read_lock = self.conn, self._lock
+        else:
+            self.read_conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+            self.read_conn.execute('PRAGMA query_only=1')
+            self._read_lock = threading.Lock()
+    
+    def close(self):
+        """Chiude le connessioni al database"""
+        if self.read_conn and self.read_conn is not self.conn:
+            with self._read_lock:
+                self.read_conn.close()
+        self.read_conn = None
+        
+        if self.conn:
+            with self._lock:
+                self._flush_pending()
+                # Aggiorna le statistiche del planner solo se necessario
+                self.conn.execute('PRAGMA optimize')
+                self.conn.close()
+                self.conn = None
     
     def init_database(self):
         """Inizializza il database SQLite con le tabelle necessarie"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        with self._lock:
+            cursor = self.conn.cursor()
             
-            # Tabella per i report di sincronizzazione
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sync_reports (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sync_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    files_transferred INTEGER DEFAULT 0,
-                    duplicates_found INTEGER DEFAULT 0,
-                    duplicates_renamed INTEGER DEFAULT 0,
-                    errors_count INTEGER DEFAULT 0,
-                    skipped_files INTEGER DEFAULT 0,
-                    already_processed INTEGER DEFAULT 0,
-                    total_size_bytes INTEGER DEFAULT 0,
-                    duration_seconds REAL,
-                    source_path TEXT,
-                    dest_path TEXT,
-                    status TEXT,
-                    resumed_from_id INTEGER
-                )
-            ''')
+            # Schema già aggiornato: nessuna DDL da eseguire
+            current_version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            if current_version == self.SCHEMA_VERSION:
+                return
             
-            # Tabella per i dettagli dei file trasferiti
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS transferred_files (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sync_id INTEGER,
-                    source_file TEXT,
-                    dest_file TEXT,
-                    file_hash TEXT,
-                    file_size INTEGER,
-                    transfer_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_duplicate BOOLEAN DEFAULT FALSE,
-                    processing_status TEXT DEFAULT 'COMPLETED',
-                    FOREIGN KEY (sync_id) REFERENCES sync_reports (id)
-                )
-            ''')
+            # Creazione atomica dello schema in un'unica transazione
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                # Prima della versione 5 l'elenco remoto non aveva dimensione e mtime:
+                # è solo una cache, viene ricreato e ripopolato dalla prossima scansione
+                if 0 < current_version < 5:
+                    cursor.execute('DROP TABLE IF EXISTS remote_file_index')
+                self._create_schema(cursor)
+                cursor.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
             
-            # Tabella per gli errori
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sync_errors (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sync_id INTEGER,
-                    error_message TEXT,
-                    file_path TEXT,
-                    error_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (sync_id) REFERENCES sync_reports (id)
-                )
-            ''')
-            
-            conn.commit()
+            # Aggiorna le statistiche per il query planner
+            cursor.execute('ANALYZE')
+    
+    def _create_schema(self, cursor):
+        """Crea tabelle e indici del database"""
+        # Tabella per i report di sincronizzazione
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sync_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                files_transferred INTEGER DEFAULT 0,
+                duplicates_found INTEGER DEFAULT 0,
+                duplicates_renamed INTEGER DEFAULT 0,
+                errors_count INTEGER DEFAULT 0,
+                skipped_files INTEGER DEFAULT 0,
+                already_processed INTEGER DEFAULT 0,
+                total_size_bytes INTEGER DEFAULT 0,
+                duration_seconds REAL,
+                source_path TEXT,
+                dest_path TEXT,
+                status TEXT,
+                resumed_from_id INTEGER
+            )
+        ''')
+        
+        # Tabella per i dettagli dei file trasferiti
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS transferred_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sync_id INTEGER,
+                source_file TEXT,
+                dest_file TEXT,
+                file_hash TEXT,
+                file_size INTEGER,
+                transfer_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_duplicate BOOLEAN DEFAULT FALSE,
+                processing_status TEXT DEFAULT 'COMPLETED',
+                FOREIGN KEY (sync_id) REFERENCES sync_reports (id)
+            )
+        ''')
+        
+        # Tabella per gli errori
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_errors (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sync_id INTEGER,
+                error_message TEXT,
+                file_path TEXT,
+                error_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (sync_id) REFERENCES sync_reports (id)
+            )
+        ''')
+        
+        # Cache degli hash dei file locali, valida finché dimensione e mtime non cambiano
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_hash_cache (
+                dev INTEGER,
+                ino INTEGER,
+                algorithm TEXT,
+                size INTEGER,
+                mtime_ns INTEGER,
+                file_hash TEXT,
+                UNIQUE (dev, ino, algorithm)
+            )
+        ''')
+        
+        # Hash dei file remoti della sincronizzazione corrente, usata quando sono troppi per la memoria
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS remote_hashes (
+                file_hash TEXT PRIMARY KEY,
+                remote_path TEXT
+            )
+        ''')
+        
+        # Elenco dei file remoti dell'ultima scansione per destinazione e algoritmo: riusato nelle
+        # riprese e, con dimensione e mtime, per non ricalcolare l'hash dei file non modificati
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS remote_file_index (
+                dest_path TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                remote_path TEXT NOT NULL,
+                size INTEGER,
+                mtime TEXT,
+                file_hash TEXT NOT NULL,
+                PRIMARY KEY (dest_path, algorithm, remote_path)
+            )
+        ''')
+        
+        # Indici per le query usate durante la sincronizzazione
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_reports_paths_status
+            ON sync_reports (source_path, dest_path, status, sync_date DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tf_sync_status
+            ON transferred_files (sync_id, processing_status)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_tf_source
+            ON transferred_files (source_file)
+        ''')
+        
+        # Indici per i report: errori di una sincronizzazione e sincronizzazioni recenti
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_errors_sync
+            ON sync_errors (sync_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_reports_date
+            ON sync_reports (sync_date DESC)
+        ''')
+    
+    def _flush_pending(self):
+        """Scrive le righe in attesa in un'unica transazione (richiede il lock)"""
+        if not (self._pending_files or self._pending_errors or self._pending_hashes
+                or self._pending_remote_hashes or self._pending_remote_index):
+            return
+        
+        cursor = self.conn.cursor()
+        # BEGIN IMMEDIATE prende subito il lock di scrittura, evitando l'upgrade del lock
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            if self._pending_files:
+                cursor.executemany(self.INSERT_TRANSFERRED_FILE, self._pending_files)
+            if self._pending_errors:
+                cursor.executemany(self.INSERT_ERROR, self._pending_errors)
+            if self._pending_hashes:
+                cursor.executemany(self.UPSERT_FILE_HASH, self._pending_hashes)
+            if self._pending_remote_hashes:
+                cursor.executemany(self.UPSERT_REMOTE_HASH, self._pending_remote_hashes)
+            if self._pending_remote_index:
+                cursor.executemany(self.UPSERT_REMOTE_INDEX, self._pending_remote_index)
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        
+        self._pending_files.clear()
+        self._pending_errors.clear()
+        self._pending_hashes.clear()
+        self._pending_remote_hashes.clear()
+        self._pending_remote_index.clear()
+    
+    def flush(self):
+        """Forza la scrittura su disco delle righe in attesa"""
+        with self._lock:
+            self._flush_pending()
     
     def start_sync_session(self, source_path, dest_path, resumed_from=None):
         """Inizia una nuova sessione di sincronizzazione"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        with self._lock:
+            cursor = self.conn.cursor()
             cursor.execute('''
                 INSERT INTO sync_reports (source_path, dest_path, status, resumed_from_id)
                 VALUES (?, ?, 'RUNNING', ?)
-            ''', (str(source_path), str(dest_path), resumed_from))
+            ''', (os.fspath(source_path), os.fspath(dest_path), resumed_from))
             return cursor.lastrowid
     
     def update_sync_report(self, sync_id, report, duration_seconds, status='COMPLETED'):
         """Aggiorna il report di sincronizzazione"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE sync_reports SET
-                    files_transferred = ?,
-                    duplicates_found = ?,
-                    duplicates_renamed = ?,
-                    errors_count = ?,
-                    skipped_files = ?,
-                    already_processed = ?,
-                    total_size_bytes = ?,
-                    duration_seconds = ?,
-                    status = ?
-                WHERE id = ?
-            ''', (
+        with self._lock:
+            self._flush_pending()
+            self.conn.execute(self.UPDATE_SYNC_REPORT, (
                 report.files_transferred,
                 report.duplicates_found, 
                 report.duplicates_renamed,
-                len(report.errors),
+                report.error_count,
                 report.skipped_files,
                 report.already_processed,
                 report.total_size_transferred,
@@ -107,33 +315,151 @@ class DatabaseManager:
             ))
     
     def log_transferred_file(self, sync_id, source_file, dest_file, file_hash, file_size, is_duplicate=False, status='COMPLETED'):
-        """Registra un file trasferito"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO transferred_files 
-                (sync_id, source_file, dest_file, file_hash, file_size, is_duplicate, processing_status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (sync_id, str(source_file), str(dest_file), file_hash, file_size, is_duplicate, status))
+        """Registra un file trasferito (scritto in blocco ogni FLUSH_EVERY righe)"""
+        with self._lock:
+            self._pending_files.append(
+                (sync_id, os.fspath(source_file), os.fspath(dest_file), file_hash, file_size, is_duplicate, status)
+            )
+            if len(self._pending_files) >= self.FLUSH_EVERY:
+                self._flush_pending()
     
     def log_error(self, sync_id, error_message, file_path=None):
-        """Registra un errore"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        """Registra un errore (scritto in blocco ogni FLUSH_EVERY righe)"""
+        with self._lock:
+            self._pending_errors.append(
+                (sync_id, error_message, os.fspath(file_path) if file_path else None)
+            )
+            if len(self._pending_errors) >= self.FLUSH_EVERY:
+                self._flush_pending()
+    
+    def get_cached_file_hash(self, file_stat, algorithm):
+        """Restituisce l'hash in cache se dimensione e mtime del file non sono cambiati"""
+        with self._lock:
+            cursor = self.conn.cursor()
             cursor.execute('''
-                INSERT INTO sync_errors (sync_id, error_message, file_path)
-                VALUES (?, ?, ?)
-            ''', (sync_id, error_message, str(file_path) if file_path else None))
+                SELECT file_hash FROM file_hash_cache
+                WHERE dev = ? AND ino = ? AND algorithm = ? AND size = ? AND mtime_ns = ?
+            ''', (file_stat.st_dev, file_stat.st_ino, algorithm, file_stat.st_size, file_stat.st_mtime_ns))
+            result = cursor.fetchone()
+            return result[0] if result else None
+    
+    def cache_file_hash(self, file_stat, algorithm, file_hash):
+        """Salva l'hash di un file locale (scritto in blocco ogni FLUSH_EVERY righe)"""
+        with self._lock:
+            self._pending_hashes.append(
+                (file_stat.st_dev, file_stat.st_ino, algorithm, file_stat.st_size, file_stat.st_mtime_ns, file_hash)
+            )
+            if len(self._pending_hashes) >= self.FLUSH_EVERY:
+                self._flush_pending()
+    
+    def clear_remote_hashes(self):
+        """Svuota la tabella degli hash remoti prima di una nuova scansione"""
+        with self._lock:
+            self._pending_remote_hashes.clear()
+            self.conn.execute('DELETE FROM remote_hashes')
+    
+    def add_remote_hash(self, file_hash, remote_path):
+        """Registra l'hash di un file remoto (scritto in blocco ogni FLUSH_EVERY righe)"""
+        with self._lock:
+            self._pending_remote_hashes.append((file_hash, os.fspath(remote_path)))
+            if len(self._pending_remote_hashes) >= self.FLUSH_EVERY:
+                self._flush_pending()
+    
+    def get_remote_hash_path(self, file_hash):
+        """Restituisce il percorso remoto con questo hash, se presente"""
+        with self._lock:
+            if self._pending_remote_hashes:
+                self._flush_pending()
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT remote_path FROM remote_hashes WHERE file_hash = ?', (file_hash,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+    
+    def get_remote_hash_paths(self, file_hashes):
+        """Risolve più hash remoti con una query per blocco: {hash: percorso} dei soli presenti"""
+        file_hashes = list(file_hashes)
+        found = {}
+        with self._lock:
+            if self._pending_remote_hashes:
+                self._flush_pending()
+            cursor = self.conn.cursor()
+            
+            # Query a blocchi per restare sotto il limite di parametri di SQLite
+            for start in range(0, len(file_hashes), self.MAX_QUERY_PARAMS):
+                chunk = file_hashes[start:start + self.MAX_QUERY_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT file_hash, remote_path FROM remote_hashes
+                    WHERE file_hash IN ({placeholders})
+                ''', chunk)
+                found.update(cursor)
+        return found
+    
+    def delete_remote_hash(self, file_hash):
+        """Rimuove l'hash di un file remoto non più presente"""
+        with self._lock:
+            self._flush_pending()
+            self.conn.execute('DELETE FROM remote_hashes WHERE file_hash = ?', (file_hash,))
+    
+    def replace_remote_index(self, dest_path, algorithm, entries):
+        """Sostituisce in un'unica transazione l'elenco dei file remoti salvato per la destinazione
+        
+        entries contiene tuple (percorso, hash, dimensione, mtime) di una scansione completa:
+        se la scansione si interrompe prima, l'elenco precedente resta intatto.
+        """
+        dest_path = os.fspath(dest_path)
+        with self._lock:
+            self._flush_pending()
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute(
+                    'DELETE FROM remote_file_index WHERE dest_path = ? AND algorithm = ?',
+                    (dest_path, algorithm)
+                )
+                cursor.executemany(self.UPSERT_REMOTE_INDEX, (
+                    (dest_path, algorithm, os.fspath(remote_path), size, mtime, file_hash)
+                    for remote_path, file_hash, size, mtime in entries
+                ))
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+    
+    def add_remote_index_entry(self, dest_path, algorithm, remote_path, file_hash, size=None, mtime=None):
+        """Registra un file remoto della destinazione (scritto in blocco ogni FLUSH_EVERY righe)
+        
+        mtime è in secondi interi, come la parte intera di %T@ di find.
+        Senza dimensione e mtime l'hash sarà ricalcolato alla prossima scansione.
+        """
+        with self._lock:
+            self._pending_remote_index.append(
+                (os.fspath(dest_path), algorithm, os.fspath(remote_path), size, mtime, file_hash)
+            )
+            if len(self._pending_remote_index) >= self.FLUSH_EVERY:
+                self._flush_pending()
+    
+    def get_remote_index(self, dest_path, algorithm):
+        """Restituisce le righe (percorso, hash, dimensione, mtime) dei file remoti salvati per la destinazione"""
+        with self._lock:
+            self._flush_pending()
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT remote_path, file_hash, size, mtime FROM remote_file_index
+                WHERE dest_path = ? AND algorithm = ?
+            ''', (os.fspath(dest_path), algorithm))
+            return cursor.fetchall()
     
     def find_incomplete_sync(self, source_path, dest_path):
         """Trova una sincronizzazione incompleta per lo stesso percorso"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        with self._lock:
+            self._flush_pending()
+            cursor = self.conn.cursor()
             cursor.execute('''
                 SELECT id FROM sync_reports 
                 WHERE source_path = ? AND dest_path = ? AND status IN ('RUNNING', 'INTERRUPTED')
                 ORDER BY sync_date DESC LIMIT 1
-            ''', (str(source_path), str(dest_path)))
+            ''', (os.fspath(source_path), os.fspath(dest_path)))
             result = cursor.fetchone()
             return result[0] if result else None
     
@@ -142,27 +468,34 @@ class DatabaseManager:
         if not sync_ids:
             return set()
             
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            placeholders = ','.join('?' * len(sync_ids))
-            cursor.execute(f'''
-                SELECT DISTINCT source_file FROM transferred_files 
-                WHERE sync_id IN ({placeholders}) AND processing_status = 'COMPLETED'
-            ''', sync_ids)
-            return {row[0] for row in cursor.fetchall()}
+        sync_ids = list(sync_ids)
+        processed = set()
+        with self._lock:
+            self._flush_pending()
+            cursor = self.conn.cursor()
+            
+            # Query a blocchi per restare sotto il limite di parametri di SQLite
+            for start in range(0, len(sync_ids), self.MAX_QUERY_PARAMS):
+                chunk = sync_ids[start:start + self.MAX_QUERY_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT DISTINCT source_file FROM transferred_files 
+                    WHERE sync_id IN ({placeholders}) AND processing_status = 'COMPLETED'
+                ''', chunk)
+                processed.update(row[0] for row in cursor)
+        return processed
     
     def mark_sync_interrupted(self, sync_id):
         """Marca una sincronizzazione come interrotta"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE sync_reports SET status = 'INTERRUPTED' WHERE id = ?
-            ''', (sync_id,))
+        with self._lock:
+            self._flush_pending()
+            self.conn.execute(self.UPDATE_SYNC_STATUS, ('INTERRUPTED', sync_id))
     
     def get_all_previous_processed_files(self, source_path, dest_path, exclude_sync_id=None):
         """Ottiene tutti i file già elaborati per questo percorso (da tutte le sync precedenti)"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        with self._lock:
+            self._flush_pending()
+            cursor = self.conn.cursor()
             query = '''
                 SELECT DISTINCT tf.source_file, tf.file_hash 
                 FROM transferred_files tf
@@ -170,19 +503,52 @@ class DatabaseManager:
                 WHERE sr.source_path = ? AND sr.dest_path = ? 
                 AND tf.processing_status = 'COMPLETED'
             '''
-            params = [str(source_path), str(dest_path)]
+            params = [os.fspath(source_path), os.fspath(dest_path)]
             
             if exclude_sync_id:
                 query += ' AND tf.sync_id != ?'
                 params.append(exclude_sync_id)
             
             cursor.execute(query, params)
-            return {row[0]: row[1] for row in cursor.fetchall()}
+            return {row[0]: row[1] for row in cursor}
+    
+    def is_file_processed(self, source_file, source_path, dest_path):
+        """Verifica puntuale se un file risulta già elaborato per questo percorso"""
+        with self._lock:
+            self._flush_pending()
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT 1 FROM transferred_files tf
+                JOIN sync_reports sr ON tf.sync_id = sr.id
+                WHERE tf.source_file = ? AND sr.source_path = ? AND sr.dest_path = ?
+                AND tf.processing_status = 'COMPLETED'
+                LIMIT 1
+            ''', (os.fspath(source_file), os.fspath(source_path), os.fspath(dest_path)))
+            return cursor.fetchone() is not None
+    
+    def is_file_processed_in_syncs(self, source_file, sync_ids):
+        """Verifica puntuale se un file risulta completato in una delle sincronizzazioni indicate"""
+        sync_ids = list(sync_ids)
+        with self._lock:
+            self._flush_pending()
+            cursor = self.conn.cursor()
+            for start in range(0, len(sync_ids), self.MAX_QUERY_PARAMS):
+                chunk = sync_ids[start:start + self.MAX_QUERY_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT 1 FROM transferred_files
+                    WHERE source_file = ? AND sync_id IN ({placeholders}) AND processing_status = 'COMPLETED'
+                    LIMIT 1
+                ''', [os.fspath(source_file), *chunk])
+                if cursor.fetchone() is not None:
+                    return True
+        return False
     
     def get_recent_reports(self, limit=10):
         """Ottiene i report più recenti"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        self.flush()
+        with self._read_lock:
+            cursor = self.read_conn.cursor()
             cursor.execute('''
                 SELECT * FROM sync_reports 
                 ORDER BY sync_date DESC 
@@ -192,8 +558,9 @@ class DatabaseManager:
     
     def get_sync_statistics(self, sync_id):
         """Ottiene statistiche dettagliate per una sincronizzazione"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        self.flush()
+        with self._read_lock:
+            cursor = self.read_conn.cursor()
             
             # Statistiche generali
             cursor.execute('SELECT * FROM sync_reports WHERE id = ?', (sync_id,))
@@ -6,35 +6,161 @@ Gestisce operazioni sui file, calcolo hash e controlli
 
 import hashlib
 import logging
-from pathlib import Path
+import math
+import mmap
+import os
+import posixpath
+import re
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 class FileUtils:
     
     # Estensioni multimediali supportate
-    MEDIA_EXTENSIONS = [
+    MEDIA_EXTENSIONS = frozenset({
         '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp',  # Immagini
         '.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm',    # Video
         '.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma'            # Audio
-    ]
+    })
+    
+    # Thread usati per il calcolo parallelo degli hash
+    HASH_WORKERS = 8
+    
+    # Intervallo di dimensioni in cui i file vengono mappati in memoria per l'hash; oltre il
+    # limite superiore si legge a blocchi (spazio di indirizzi ridotto sui sistemi a 32 bit)
+    MMAP_THRESHOLD = 1024 * 1024
+    MMAP_MAX_SIZE = 256 * 1024 * 1024
+    
+    # Algoritmi di hash supportati: comando remoto equivalente, prefisso salvato nel database
+    # e pacchetto pip necessario in locale
+    HASH_ALGORITHMS = {
+        'md5': {'remote_command': 'md5sum', 'prefix': '', 'package': None},
+        'blake3': {'remote_command': 'b3sum', 'prefix': 'b3:', 'package': 'blake3'},
+        'xxh128': {'remote_command': 'xxh128sum', 'prefix': 'xxh128:', 'package': 'xxhash'},
+        'sha256': {'remote_command': 'sha256sum', 'prefix': 'sha256:', 'package': None},
+    }
+    DEFAULT_HASH_ALGORITHM = 'md5'
+    
+    # Valore speciale: algoritmo scelto in base al server dopo la connessione
+    AUTO_HASH_ALGORITHM = 'auto'
+    
+    # Cifre dell'hash nel nome dei duplicati (64 bit: collisioni trascurabili anche su molti file)
+    DUPLICATE_HASH_LENGTH = 16
     
     @staticmethod
-    def calculate_file_hash(file_path, chunk_size=8192):
-        """Calcola l'hash MD5 di un file locale"""
-        hash_md5 = hashlib.md5()
+    def is_hash_algorithm_available(algorithm):
+        """Verifica se l'algoritmo di hash è utilizzabile localmente"""
+        if algorithm == 'blake3':
+            return blake3 is not None
+        if algorithm == 'xxh128':
+            return xxhash is not None
+        return algorithm in FileUtils.HASH_ALGORITHMS or algorithm == FileUtils.AUTO_HASH_ALGORITHM
+    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def hasher_factory(algorithm=DEFAULT_HASH_ALGORITHM, multithreaded=False):
+        """Risolve una sola volta il costruttore dell'hash per l'algoritmo richiesto"""
+        if algorithm == 'blake3':
+            if blake3 is None:
+                raise ImportError("Modulo blake3 non installato (pip install blake3)")
+            # Per file grandi BLAKE3 può suddividere l'hash su più core
+            return partial(blake3.blake3, max_threads=blake3.blake3.AUTO if multithreaded else 1)
+        if algorithm == 'xxh128':
+            if xxhash is None:
+                raise ImportError("Modulo xxhash non installato (pip install xxhash)")
+            # XXH3 a 128 bit, lo stesso di xxh128sum
+            return xxhash.xxh3_128
+        # Il costruttore dedicato (hashlib.md5) evita la ricerca per nome di hashlib.new
+        return getattr(hashlib, algorithm, None) or partial(hashlib.new, algorithm)
+    
+    @staticmethod
+    def new_hasher(algorithm=DEFAULT_HASH_ALGORITHM, multithreaded=False):
+        """Crea un oggetto hash per l'algoritmo richiesto"""
+        return FileUtils.hasher_factory(algorithm, multithreaded)()
+    
+    @staticmethod
+    def format_hash(hexdigest, algorithm=DEFAULT_HASH_ALGORITHM):
+        """Aggiunge all'hash il prefisso che identifica l'algoritmo"""
+        return FileUtils.HASH_ALGORITHMS[algorithm]['prefix'] + hexdigest
+    
+    @staticmethod
+    def calculate_file_hash(file_path, chunk_size=1024 * 1024, algorithm=DEFAULT_HASH_ALGORITHM):
+        """Calcola l'hash (MD5 di default) di un file locale"""
         try:
-            with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(chunk_size), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+            with open(file_path, "rb", buffering=0) as f:
+                # Lettura sequenziale: il kernel può anticipare il read-ahead
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                
+                # File medio-grandi: un'unica update sul file mappato, senza copie in buffer Python
+                if FileUtils.MMAP_THRESHOLD <= os.fstat(f.fileno()).st_size < FileUtils.MMAP_MAX_SIZE:
+                    try:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            if hasattr(mm, 'madvise'):
+                                mm.madvise(mmap.MADV_SEQUENTIAL)
+                            hasher = FileUtils.new_hasher(algorithm, multithreaded=True)
+                            hasher.update(mm)
+                            return FileUtils.format_hash(hasher.hexdigest(), algorithm)
+                    except (OSError, ValueError) as e:
+                        # Filesystem senza supporto mmap (es. alcuni mount di rete): lettura a blocchi
+                        logging.debug(f"mmap non disponibile per {file_path}, lettura a blocchi: {e}")
+                
+                # Python 3.11+: lettura e hash interamente in C
+                if hasattr(hashlib, 'file_digest'):
+                    hasher = hashlib.file_digest(f, FileUtils.hasher_factory(algorithm))
+                    return FileUtils.format_hash(hasher.hexdigest(), algorithm)
+                
+                hasher = FileUtils.new_hasher(algorithm)
+                while chunk := f.read(chunk_size):
+                    hasher.update(chunk)
+                return FileUtils.format_hash(hasher.hexdigest(), algorithm)
         except Exception as e:
             logging.error(f"Errore nel calcolo hash per {file_path}: {e}")
             return None
     
     @staticmethod
-    def calculate_remote_file_hash(ssh_client, remote_path):
-        """Calcola l'hash MD5 di un file remoto via SSH"""
+    def drop_page_cache(file_path):
+        """Chiede al kernel di liberare dalla page cache le pagine di un file già letto"""
+        if not hasattr(os, 'posix_fadvise'):
+            return
         try:
-            cmd = f"md5sum '{remote_path}' | cut -d' ' -f1"
+            fd = os.open(file_path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logging.debug(f"posix_fadvise non riuscito per {file_path}: {e}")
+    
+    @staticmethod
+    def hash_files_parallel(paths, hash_func=None, workers=None):
+        """Calcola gli hash di più file in parallelo, restituendo (percorso, hash) appena pronti"""
+        if hash_func is None:
+            hash_func = FileUtils.calculate_file_hash
+        
+        with ThreadPoolExecutor(max_workers=workers or FileUtils.HASH_WORKERS) as executor:
+            futures = {executor.submit(hash_func, path): path for path in paths}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    
+    @staticmethod
+    def calculate_remote_file_hash(ssh_client, remote_path, algorithm=DEFAULT_HASH_ALGORITHM):
+        """Calcola l'hash (MD5 di default) di un file remoto via SSH"""
+        try:
+            remote_command = FileUtils.HASH_ALGORITHMS[algorithm]['remote_command']
+            cmd = f"{remote_command} {shlex.quote(str(remote_path))} | cut -d' ' -f1"
             stdin, stdout, stderr = ssh_client.exec_command(cmd)
             hash_result = stdout.read().decode().strip()
             error = stderr.read().decode().strip()
@@ -43,38 +169,104 @@ class FileUtils:
                 logging.warning(f"Warning calcolo hash remoto {remote_path}: {error}")
                 return None
                 
-            return hash_result if hash_result else None
+            return FileUtils.format_hash(hash_result, algorithm) if hash_result else None
             
         except Exception as e:
             logging.error(f"Errore calcolo hash remoto {remote_path}: {e}")
             return None
     
+    @staticmethod
+    def detect_remote_hash_algorithm(ssh_client):
+        """Sceglie l'algoritmo di hash più veloce disponibile sia sul server che in locale
+        
+        xxh128 se il server ha xxh128sum, sha256 se la CPU del server accelera SHA-256
+        (sha_ni su x86, sha2 su ARMv8), altrimenti md5.
+        """
+        detect_cmd = (
+            "command -v xxh128sum >/dev/null 2>&1 && echo xxh128; "
+            "grep -qw -m1 -e sha_ni -e sha2 /proc/cpuinfo 2>/dev/null && echo sha256; true"
+        )
+        try:
+            stdin, stdout, stderr = ssh_client.exec_command(detect_cmd)
+            candidates = stdout.read().decode().split()
+        except Exception as e:
+            logging.warning(f"Rilevamento algoritmo hash remoto fallito: {e}")
+            candidates = []
+        
+        for algorithm in candidates:
+            if algorithm in FileUtils.HASH_ALGORITHMS and FileUtils.is_hash_algorithm_available(algorithm):
+                return algorithm
+        return FileUtils.DEFAULT_HASH_ALGORITHM
+    
+    @staticmethod
+    def parse_checksum_line(line):
+        """Estrae (hash, percorso) da una riga di output di md5sum/b3sum"""
+        line = line.rstrip('\n')
+        if not line:
+            return None, None
+        
+        # md5sum/b3sum antepongono '\' quando il nome file contiene caratteri di escape
+        escaped = line.startswith('\\')
+        if escaped:
+            line = line[1:]
+        
+        file_hash, _, file_path = line.partition('  ')
+        if escaped:
+            file_path = re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), file_path)
+        
+        return (file_hash, file_path) if file_hash and file_path else (None, None)
+    
+    @staticmethod
+    def normalize_extensions(extensions=None):
+        """Converte le estensioni in un frozenset di suffissi minuscoli con il punto iniziale"""
+        if not extensions:
+            return FileUtils.MEDIA_EXTENSIONS
+        return frozenset(
+            ext.lower() if ext.startswith('.') else f".{ext.lower()}"
+            for ext in extensions
+        )
+    
     @staticmethod
     def is_media_file(file_path, extensions=None):
         """Verifica se il file è multimediale"""
         if extensions is None:
             extensions = FileUtils.MEDIA_EXTENSIONS
-        return any(str(file_path).lower().endswith(ext) for ext in extensions)
+        return os.path.splitext(os.fspath(file_path))[1].lower() in extensions
     
     @staticmethod
-    def generate_duplicate_name(ssh_client, remote_path, dry_run=False):
-        """Genera un nome per file duplicato aggiungendo _DUP prima dell'estensione"""
-        path_obj = Path(remote_path)
-        stem = path_obj.stem
-        suffix = path_obj.suffix
-        parent = path_obj.parent
+    def generate_duplicate_name(ssh_client, remote_path, dry_run=False, reserved=(), file_hash=None):
+        """Genera un nome per file duplicato aggiungendo _DUP prima dell'estensione
+        
+        Con file_hash il nome deriva dal contenuto (_DUP_<16 cifre dell'hash>) e non
+        serve interrogare il server: con 64 bit di hash un file con lo stesso nome ha
+        lo stesso contenuto.
+        reserved contiene i percorsi già assegnati ma non ancora presenti sul server
+        (file in attesa di trasferimento in blocco).
+        """
+        parent, name = posixpath.split(os.fspath(remote_path))
+        stem, suffix = posixpath.splitext(name)
+        
+        if file_hash:
+            short_hash = file_hash.rpartition(':')[2][:FileUtils.DUPLICATE_HASH_LENGTH]
+            new_path = posixpath.join(parent, f"{stem}_DUP_{short_hash}{suffix}")
+            if dry_run or new_path not in reserved:
+                return new_path
         
         counter = 1
         while True:
             new_name = f"{stem}_DUP{counter if counter > 1 else ''}{suffix}"
-            new_path = parent / new_name
+            new_path = posixpath.join(parent, new_name)
             
             if dry_run:
                 # In dry-run, simula che il file non esiste
                 return new_path
             
+            if new_path in reserved:
+                counter += 1
+                continue
+            
             # Verifica se esiste sul server remoto
-            check_cmd = f"test -f '{new_path}' && echo 'exists' || echo 'not_exists'"
+            check_cmd = f"test -f {shlex.quote(str(new_path))} && echo 'exists' || echo 'not_exists'"
             stdin, stdout, stderr = ssh_client.exec_command(check_cmd)
             result = stdout.read().decode().strip()
             
@@ -82,19 +274,39 @@ class FileUtils:
                 return new_path
             counter += 1
     
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def media_name_pattern(extensions):
+        """Compila una sola volta per insieme di estensioni la regex che riconosce i file multimediali"""
+        alternatives = '|'.join(re.escape(ext[1:]) for ext in sorted(extensions))
+        return re.compile(rf'\.(?:{alternatives})\Z', re.IGNORECASE)
+    
+    @staticmethod
+    def _scan_media_paths(source_path, extensions):
+        """Percorre ricorsivamente source_path con os.scandir e restituisce i file multimediali"""
+        is_media_name = FileUtils.media_name_pattern(extensions).search
+        pending_dirs = [os.fspath(source_path)]
+        while pending_dirs:
+            current_dir = pending_dirs.pop()
+            try:
+                with os.scandir(current_dir) as entries:
+                    for entry in entries:
+                        # DirEntry usa il tipo letto dalla directory, senza stat aggiuntive
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                        elif is_media_name(entry.name) and entry.is_file():
+                            yield entry.path
+            except PermissionError as e:
+                logging.warning(f"Directory non accessibile, ignorata: {e}")
+    
     @staticmethod
     def get_local_media_files(source_path, extensions=None):
         """Ottiene la lista di tutti i file multimediali locali"""
-        if extensions is None:
-            extensions = FileUtils.MEDIA_EXTENSIONS
+        extensions = FileUtils.normalize_extensions(extensions)
             
         try:
-            source_path = Path(source_path)
-            local_files = []
-            
-            for file_path in source_path.rglob('*'):
-                if file_path.is_file() and FileUtils.is_media_file(file_path, extensions):
-                    local_files.append(file_path)
+            # Percorsi come stringhe: nessun oggetto Path per file
+            local_files = list(FileUtils._scan_media_paths(source_path, extensions))
             
             logging.info(f"Trovati {len(local_files)} file multimediali locali")
             return local_files
@@ -106,11 +318,12 @@ class FileUtils:
     @staticmethod
     def get_relative_path(file_path, base_path):
         """Ottiene il percorso relativo di un file rispetto a un percorso base"""
-        try:
-            return Path(file_path).relative_to(Path(base_path))
-        except ValueError:
-            # Se il file non è sotto base_path, usa solo il nome del file
-            return Path(file_path).name
+        file_path = os.fspath(file_path)
+        base_prefix = os.path.join(os.fspath(base_path), '')
+        if file_path.startswith(base_prefix):
+            return file_path[len(base_prefix):]
+        # Se il file non è sotto base_path, usa solo il nome del file
+        return os.path.basename(file_path)
     
     @staticmethod
     def ensure_remote_directory(ssh_client, remote_path, dry_run=False):
@@ -120,7 +333,7 @@ class FileUtils:
             return True
         
         try:
-            mkdir_cmd = f"mkdir -p '{remote_path}'"
+            mkdir_cmd = f"mkdir -p {shlex.quote(str(remote_path))}"
             stdin, stdout, stderr = ssh_client.exec_command(mkdir_cmd)
             exit_status = stdout.channel.recv_exit_status()
             
@@ -135,13 +348,93 @@ class FileUtils:
             logging.error(f"Errore creazione directory {remote_path}: {e}")
             return False
 
+class BloomFilter:
+    """Filtro di Bloom compatto: nessun falso negativo, falsi positivi con probabilità error_rate"""
+    
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+    
+    def _positions(self, item):
+        """Calcola le posizioni dei bit con il double hashing di un unico digest"""
+        digest = hashlib.blake2b(item.encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+    
+    def add(self, item):
+        """Aggiunge un elemento al filtro"""
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class ScalableBloomFilter:
+    """Filtro di Bloom che cresce aggiungendo stadi di capacità doppia ed errore dimezzato"""
+    
+    def __init__(self, initial_capacity, error_rate=0.01):
+        self.capacity = initial_capacity
+        self.error_rate = error_rate / 2
+        self.count = 0
+        self.filters = [BloomFilter(self.capacity, self.error_rate)]
+    
+    def add(self, item):
+        """Aggiunge un elemento, aprendo un nuovo stadio quando quello corrente è pieno"""
+        if self.count >= self.capacity:
+            self.capacity *= 2
+            self.error_rate /= 2
+            self.count = 0
+            self.filters.append(BloomFilter(self.capacity, self.error_rate))
+        self.filters[-1].add(item)
+        self.count += 1
+    
+    def __contains__(self, item):
+        return any(item in bloom for bloom in self.filters)
+
 class DuplicateChecker:
     """Classe per gestire il controllo dei duplicati"""
     
+    # Oltre questa soglia i percorsi già elaborati sono tenuti in un filtro di Bloom
+    BLOOM_THRESHOLD = 500000
+    BLOOM_ERROR_RATE = 0.01
+    
     def __init__(self, db_manager):
         self.db_manager = db_manager
+        # Percorsi già elaborati come digest a 64 bit (vedi path_digest): nessuna stringa
+        # trattenuta in memoria; ogni corrispondenza è verificata sul database
         self.processed_files = set()
+        self.processed_hashes = set()
         self.remote_file_hashes = {}
+        
+        # Origine dei file già elaborati, per la verifica sul database:
+        # storico di (sorgente, destinazione) e sincronizzazioni interrotte
+        self.processed_scope = None
+        self.processed_sync_ids = []
+        
+        # Storico molto grande: filtro di Bloom + verifica puntuale sul database
+        self.processed_bloom = None
+        self.bloom_count = 0
+        
+        # Troppi file remoti: hash su database, filtro di Bloom davanti
+        self.remote_bloom = None
+        # Hash del blocco corrente già risolti sul database: {hash: percorso o None}
+        self.remote_batch = {}
+    
+    @property
+    def processed_count(self):
+        """Numero di file già elaborati noti al checker"""
+        return len(self.processed_files) + self.bloom_count
+    
+    @staticmethod
+    def path_digest(file_path):
+        """Digest a 64 bit di un percorso, stabile tra processi (xxh64 se disponibile, altrimenti BLAKE2b)"""
+        data = file_path.encode('utf-8', 'surrogateescape')
+        if xxhash is not None:
+            return xxhash.xxh64_intdigest(data)
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
     
     def load_processed_files(self, source_path, dest_path, exclude_sync_id=None):
         """Carica i file già elaborati dalle sincronizzazioni precedenti"""
@@ -149,16 +442,27 @@ class DuplicateChecker:
             source_path, dest_path, exclude_sync_id
         )
         
-        # Estrae solo i percorsi
-        self.processed_files = set(processed_with_hash.keys())
+        # Estrae percorsi e hash per ricerche O(1)
+        if len(processed_with_hash) > self.BLOOM_THRESHOLD:
+            # ~10 bit per percorso invece di un oggetto str per voce
+            self.processed_bloom = BloomFilter(len(processed_with_hash), self.BLOOM_ERROR_RATE)
+            for file_path in processed_with_hash:
+                self.processed_bloom.add(file_path)
+            self.bloom_count = len(processed_with_hash)
+            self.processed_files = set()
+        else:
+            self.processed_files = set(map(self.path_digest, processed_with_hash))
+        self.processed_scope = (source_path, dest_path)
+        self.processed_hashes = {file_hash for file_hash in processed_with_hash.values() if file_hash}
         
-        logging.info(f"Caricati {len(self.processed_files)} file già elaborati")
+        logging.info(f"Caricati {self.processed_count} file già elaborati")
         return processed_with_hash
     
     def load_interrupted_files(self, sync_ids):
         """Carica i file da sincronizzazioni interrotte"""
         interrupted_files = self.db_manager.get_processed_files(sync_ids)
-        self.processed_files.update(interrupted_files)
+        self.processed_files.update(map(self.path_digest, interrupted_files))
+        self.processed_sync_ids.extend(sync_ids)
         
         logging.info(f"Caricati {len(interrupted_files)} file da sync interrotte")
     
@@ -166,35 +470,128 @@ class DuplicateChecker:
         """Verifica se un file è già stato elaborato in precedenza"""
         file_path_str = str(file_path)
         
-        # Controllo veloce per percorso
-        if file_path_str in self.processed_files:
-            return True
+        # Digest e filtro di Bloom escludono subito i file nuovi; i possibili match sono verificati sul database
+        if self.path_digest(file_path_str) in self.processed_files or (
+                self.processed_bloom is not None and file_path_str in self.processed_bloom):
+            if self._is_processed_in_database(file_path_str):
+                return True
         
         # Se abbiamo l'hash, controlliamo anche quello
-        if file_hash:
-            for processed_hash in self.remote_file_hashes.values():
-                if processed_hash == file_hash:
-                    return True
-        
-        return False
+        return bool(file_hash) and file_hash in self.processed_hashes
+    
+    def _is_processed_in_database(self, file_path):
+        """Verifica sul database un percorso segnalato da digest o filtro di Bloom"""
+        if self.processed_scope and self.db_manager.is_file_processed(file_path, *self.processed_scope):
+            return True
+        return bool(self.processed_sync_ids) and self.db_manager.is_file_processed_in_syncs(
+            file_path, self.processed_sync_ids
+        )
     
     def is_duplicate_in_remote(self, file_hash):
         """Verifica se un file è un duplicato sui file remoti attuali"""
-        return file_hash in self.remote_file_hashes
+        if self.remote_bloom is None:
+            return file_hash in self.remote_file_hashes
+        return self.get_existing_duplicate_path(file_hash) is not None
     
     def add_remote_file_hash(self, file_hash, file_path):
         """Aggiunge un hash di file remoto alla cache"""
+        if self.remote_bloom is not None:
+            self.remote_bloom.add(file_hash)
+            self.db_manager.add_remote_hash(file_hash, file_path)
+            if file_hash in self.remote_batch:
+                self.remote_batch[file_hash] = file_path
+            return
+        
         self.remote_file_hashes[file_hash] = file_path
+        if len(self.remote_file_hashes) > self.BLOOM_THRESHOLD:
+            self._spill_remote_hashes()
+    
+    def _spill_remote_hashes(self):
+        """Sposta la cache degli hash remoti sul database, lasciando in memoria solo il filtro di Bloom"""
+        logging.info(f"Oltre {self.BLOOM_THRESHOLD} file remoti: cache hash spostata su database")
+        self.db_manager.clear_remote_hashes()
+        self.remote_bloom = ScalableBloomFilter(2 * self.BLOOM_THRESHOLD, self.BLOOM_ERROR_RATE)
+        for file_hash, file_path in self.remote_file_hashes.items():
+            self.remote_bloom.add(file_hash)
+            self.db_manager.add_remote_hash(file_hash, file_path)
+        self.remote_file_hashes = {}
+    
+    def load_remote_index(self, dest_path, algorithm=FileUtils.DEFAULT_HASH_ALGORITHM):
+        """Ricarica nella cache i file remoti salvati dall'ultima scansione della destinazione"""
+        remote_index = self.db_manager.get_remote_index(dest_path, algorithm)
+        for remote_path, file_hash, _, _ in remote_index:
+            self.add_remote_file_hash(file_hash, remote_path)
+        
+        logging.info(f"Caricati {len(remote_index)} file remoti dall'ultima scansione")
+        return len(remote_index)
+    
+    def discard_remote_file_hash(self, file_hash):
+        """Rimuove dalla cache un hash il cui file non è arrivato sul server"""
+        if self.remote_bloom is None:
+            self.remote_file_hashes.pop(file_hash, None)
+        else:
+            self.db_manager.delete_remote_hash(file_hash)
+            if file_hash in self.remote_batch:
+                self.remote_batch[file_hash] = None
+    
+    def resolve_remote_hashes(self, file_hashes):
+        """Risolve con un'unica query gli hash di un blocco di file (solo con cache su database)"""
+        if self.remote_bloom is None:
+            return
+        
+        candidates = [file_hash for file_hash in file_hashes if file_hash and file_hash in self.remote_bloom]
+        self.remote_batch = dict.fromkeys(candidates)
+        self.remote_batch.update(self.db_manager.get_remote_hash_paths(candidates))
     
     def get_existing_duplicate_path(self, file_hash):
         """Ottiene il percorso del file duplicato esistente"""
-        return self.remote_file_hashes.get(file_hash)
+        if self.remote_bloom is None:
+            return self.remote_file_hashes.get(file_hash)
+        
+        # Il filtro di Bloom esclude subito gli hash nuovi; i possibili match sono verificati sul database
+        if file_hash not in self.remote_bloom:
+            return None
+        if file_hash in self.remote_batch:
+            return self.remote_batch[file_hash]
+        return self.db_manager.get_remote_hash_path(file_hash)
 
 class FileScanner:
     """Classe per scansionare file remoti"""
     
     @staticmethod
-    def scan_remote_files(ssh_client, remote_path, extensions, duplicate_checker, dry_run=False):
+    @lru_cache(maxsize=None)
+    def build_find_pattern(extensions):
+        """Costruisce una sola volta per insieme di estensioni il filtro -iregex per find
+        
+        Un'unica espressione regolare sostituisce la catena di -iname in OR:
+        find valuta un solo test per file invece di uno per estensione.
+        """
+        alternatives = '|'.join(re.escape(ext[1:]) for ext in sorted(extensions))
+        regex = rf'.*\.({alternatives})'
+        return f"-regextype posix-egrep -iregex {shlex.quote(regex)}"
+    
+    @staticmethod
+    def iter_null_records(stream, bufsize=1024 * 1024, separator=b'\0'):
+        """Restituisce i record (byte) separati da NUL di uno stream man mano che arrivano
+        
+        I record restano byte: i nomi file non UTF-8 vanno ripassati al server invariati.
+        """
+        pending = b''
+        while chunk := stream.read(bufsize):
+            records = (pending + chunk).split(separator)
+            pending = records.pop()
+            yield from records
+        if pending:
+            yield pending
+    
+    @staticmethod
+    def decode_remote_path(raw_path):
+        """Decodifica un percorso remoto, tollerando i nomi file non UTF-8"""
+        return raw_path.decode('utf-8', 'replace')
+    
+    @staticmethod
+    def scan_remote_files(ssh_client, remote_path, extensions, duplicate_checker, dry_run=False,
+                          hash_algorithm=FileUtils.DEFAULT_HASH_ALGORITHM):
         """Scansiona i file esistenti sul server remoto e calcola i loro hash"""
         logging.info("Scansione file esistenti sul server remoto...")
         
@@ -206,24 +603,87 @@ class FileScanner:
             # Crea la directory di destinazione se non esiste
             FileUtils.ensure_remote_directory(ssh_client, remote_path)
             
-            # Trova tutti i file multimediali esistenti
-            extensions_pattern = " -o ".join([f"-name '*.{ext[1:]}'" for ext in extensions])
-            find_cmd = f"find '{remote_path}' -type f \\( {extensions_pattern} \\)"
+            extensions_pattern = FileScanner.build_find_pattern(FileUtils.normalize_extensions(extensions))
+            remote_command = FileUtils.HASH_ALGORITHMS[hash_algorithm]['remote_command']
+            db_manager = duplicate_checker.db_manager
+            
+            # Hash dell'ultima scansione: validi finché dimensione e mtime del file non cambiano.
+            # L'elenco salvato sul database permette anche alle riprese di evitare la scansione
+            cached = {
+                file_path: (size, mtime, file_hash)
+                for file_path, file_hash, size, mtime in db_manager.get_remote_index(remote_path, hash_algorithm)
+            }
+            
+            # Il nuovo elenco sostituisce quello salvato solo a scansione completata
+            index_entries = []
+            
+            def register(file_path, file_hash, size, mtime):
+                duplicate_checker.add_remote_file_hash(file_hash, file_path)
+                index_entries.append((file_path, file_hash, size, mtime))
             
-            stdin, stdout, stderr = ssh_client.exec_command(find_cmd)
-            existing_files = stdout.read().decode().strip().split('\n')
-            existing_files = [f for f in existing_files if f.strip()]
+            # Elenco dei file con dimensione e mtime in un unico comando (record separati da NUL).
+            # Locale C: in UTF-8 l'espressione regolare non riconosce i nomi con byte non validi
+            list_cmd = (
+                f"LC_ALL=C find {shlex.quote(str(remote_path))} -type f {extensions_pattern} "
+                f"-printf '%s\\t%T@\\t%p\\0'"
+            )
+            stdin, stdout, stderr = ssh_client.exec_command(list_cmd)
             
-            logging.info(f"Trovati {len(existing_files)} file esistenti sul server")
+            files_count = 0
+            to_hash = {}
+            for record in FileScanner.iter_null_records(stdout):
+                size, mtime, raw_path = record.split(b'\t', 2)
+                file_path = FileScanner.decode_remote_path(raw_path)
+                # mtime in secondi interi: è quello che tar e SFTP conservano dei file caricati
+                size, mtime = int(size), mtime.split(b'.', 1)[0].decode()
+                files_count += 1
+                
+                cached_entry = cached.get(file_path)
+                if cached_entry is not None and cached_entry[:2] == (size, mtime):
+                    register(file_path, cached_entry[2], size, mtime)
+                else:
+                    to_hash[file_path] = (size, mtime, raw_path)
+            
+            error = stderr.read().decode('utf-8', 'replace').strip()
+            if error:
+                logging.warning(f"Warning scansione file remoti: {error}")
             
-            # Calcola hash per ogni file esistente
-            for i, file_path in enumerate(existing_files, 1):
-                if i % 50 == 0:  # Log progresso ogni 50 file
-                    logging.info(f"Calcolando hash: {i}/{len(existing_files)}")
+            logging.info(f"Hash remoti riusati: {files_count - len(to_hash)}, da calcolare: {len(to_hash)}")
+            
+            # Hash solo dei file nuovi o modificati, con i percorsi passati a xargs su stdin
+            if to_hash:
+                stdin, stdout, stderr = ssh_client.exec_command(f"xargs -0 -r {remote_command}")
+                
+                # I percorsi sono inviati da un thread mentre qui si legge l'output: con molti
+                # file gli hash riempirebbero la finestra del canale e xargs resterebbe bloccato
+                def send_paths():
+                    try:
+                        stdin.channel.sendall(b'\0'.join(raw_path for _, _, raw_path in to_hash.values()))
+                    finally:
+                        stdin.channel.shutdown_write()
+                
+                sender = threading.Thread(target=send_paths, daemon=True)
+                sender.start()
+                
+                # Elabora l'output riga per riga man mano che arriva
+                hashed_count = 0
+                for line in FileScanner.iter_null_records(stdout, separator=b'\n'):
+                    file_hash, file_path = FileUtils.parse_checksum_line(FileScanner.decode_remote_path(line))
+                    if not file_hash or file_path not in to_hash:
+                        continue
                     
-                file_hash = FileUtils.calculate_remote_file_hash(ssh_client, file_path)
-                if file_hash:
-                    duplicate_checker.add_remote_file_hash(file_hash, file_path)
+                    register(file_path, FileUtils.format_hash(file_hash, hash_algorithm), *to_hash[file_path][:2])
+                    hashed_count += 1
+                    if hashed_count % 500 == 0:  # Log progresso ogni 500 file
+                        logging.info(f"Hash calcolati: {hashed_count}/{len(to_hash)}")
+                
+                sender.join()
+                error = stderr.read().decode('utf-8', 'replace').strip()
+                if error:
+                    logging.warning(f"Warning calcolo hash remoti: {error}")
+            
+            db_manager.replace_remote_index(remote_path, hash_algorithm, index_entries)
+            logging.info(f"Trovati {files_count} file esistenti sul server")
                     
         except Exception as e:
             logging.error(f"Errore scansione file remoti: {e}")
@@ -13,6 +13,7 @@ from pathlib import Path
 # Import dei moduli personalizzati
 try:
     from database_manager import DatabaseManager
+    from file_utils import FileUtils
     from report_manager import ReportFormatter
     from sync_manager import NextcloudMediaSync
 except ImportError as e:
@@ -24,12 +25,14 @@ def setup_logging(verbose=False):
     """Configura il sistema di logging"""
     log_level = logging.DEBUG if verbose else logging.INFO
     
+    log_format = '%(asctime)s - %(levelname)s - %(message)s'
+    
     # Configura il logging base
     logging.basicConfig(
         level=log_level,
-        format='%(asctime)s - %(levelname)s - %(message)s',
+        format=log_format,
         handlers=[
-            logging.FileHandler('nextcloud_sync.log'),
+            NextcloudMediaSync.create_log_file_handler(log_format),
             logging.StreamHandler()
         ]
     )
@@ -54,6 +57,11 @@ def validate_paths(args):
         elif not ssh_key_path.is_file():
             errors.append(f"Chiave SSH non è un file: {args.ssh_key}")
     
+    # Controlla disponibilità algoritmo di hash
+    if not FileUtils.is_hash_algorithm_available(args.hash_algorithm):
+        package = FileUtils.HASH_ALGORITHMS[args.hash_algorithm]['package']
+        errors.append(f"Algoritmo hash non disponibile: {args.hash_algorithm} (pip install {package})")
+    
     # Controlla directory database
     if args.db_path:
         db_dir = Path(args.db_path).parent
@@ -90,6 +98,7 @@ def print_config_summary(args):
         print("   📄 Estensioni: Tutte le estensioni multimediali")
     
     print(f"   🗃️  Database: {args.db_path}")
+    print(f"   🔐 Hash duplicati: {args.hash_algorithm.upper()}")
     
     if args.dry_run:
         print("   🔍 Modalità: DRY-RUN (simulazione)")
@@ -168,12 +177,22 @@ ESEMPI DI UTILIZZO:
                              help='Percorso database SQLite (default: nextcloud_sync.db)')
     options_group.add_argument('--dry-run', action='store_true',
                              help='Simula operazioni senza trasferire file')
+    options_group.add_argument('--hash-algorithm',
+                             choices=sorted(FileUtils.HASH_ALGORITHMS) + [FileUtils.AUTO_HASH_ALGORITHM],
+                             default=FileUtils.DEFAULT_HASH_ALGORITHM,
+                             help='Algoritmo hash per i duplicati (default: md5, blake3 richiede b3sum e xxh128 richiede xxh128sum sul server, auto sceglie il più veloce disponibile)')
+    options_group.add_argument('--no-cache-pollute', action='store_true',
+                             help='Libera la page cache dei file dopo il trasferimento (utile su sistemi con poca RAM)')
+    options_group.add_argument('--workers', type=int, default=NextcloudMediaSync.DEFAULT_UPLOAD_WORKERS,
+                             help=f'Trasferimenti SFTP paralleli per i file non inviati via tar (default: {NextcloudMediaSync.DEFAULT_UPLOAD_WORKERS})')
     
     control_group = parser.add_argument_group('🎛️ CONTROLLO ESECUZIONE')
     control_group.add_argument('--force-new', action='store_true',
                              help='Forza nuova sincronizzazione ignorando quelle incomplete')
     control_group.add_argument('--resume', type=int, metavar='SYNC_ID',
                              help='Riprendi sincronizzazione specifica dal database')
+    control_group.add_argument('--skip-history', action='store_true',
+                             help='Salta i file già elaborati nelle sincronizzazioni precedenti (per percorso o hash)')
     
     report_group = parser.add_argument_group('📊 REPORT E MONITORAGGIO')
     report_group.add_argument('--show-reports', action='store_true',
@@ -194,6 +213,9 @@ ESEMPI DI UTILIZZO:
     # Banner di avvio
     print_banner()
     
+    db = None
+    syncer = None
+    
     try:
         # Inizializza database
         db = DatabaseManager(args.db_path)
@@ -249,7 +271,11 @@ ESEMPI DI UTILIZZO:
             ssh_key_path=args.ssh_key,
             extensions=args.extensions,
             db_path=args.db_path,
-            dry_run=args.dry_run
+            dry_run=args.dry_run,
+            hash_algorithm=args.hash_algorithm,
+            drop_page_cache=args.no_cache_pollute,
+            upload_workers=args.workers,
+            skip_history=args.skip_history
         )
         
         # Gestione opzioni di controllo
@@ -343,6 +369,13 @@ ESEMPI DI UTILIZZO:
         
         logging.exception("Errore critico durante l'esecuzione")
         return 1
+    
+    finally:
+        # Chiude le connessioni al database
+        if syncer:
+            syncer.db.close()
+        if db:
+            db.close()
 
 if __name__ == "__main__":
     # Gestisce l'esecuzione come script principale
@@ -4,12 +4,18 @@ Report Manager per la sincronizzazione Nextcloud
 Gestisce i report e le statistiche della sincronizzazione
 """
 
+from collections import deque
+
 class MediaSyncReport:
+    # Messaggi di errore conservati in memoria (il totale è in error_count, i dettagli nel database)
+    MAX_ERRORS_KEPT = 100
+    
     def __init__(self):
         self.files_transferred = 0
         self.duplicates_found = 0
         self.duplicates_renamed = 0
-        self.errors = []
+        self.errors = deque(maxlen=self.MAX_ERRORS_KEPT)
+        self.error_count = 0
         self.skipped_files = 0
         self.already_processed = 0
         self.total_size_transferred = 0
@@ -29,28 +35,30 @@ class MediaSyncReport:
         
     def add_error(self, error_msg):
         """Aggiunge un errore al report"""
+        self.error_count += 1
         self.errors.append(error_msg)
         
     def add_skipped(self):
         """Aggiunge un file saltato alle statistiche"""
         self.skipped_files += 1
     
-    def add_already_processed(self):
-        """Aggiunge un file già processato alle statistiche"""
-        self.already_processed += 1
+    def add_already_processed(self, count=1):
+        """Aggiunge uno o più file già processati alle statistiche"""
+        self.already_processed += count
 
 class ReportFormatter:
+    # Unità di misura delle dimensioni, una ogni potenza di 1024
+    SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+    
     @staticmethod
     def format_size(size_bytes):
         """Formatta la dimensione in modo leggibile"""
         if size_bytes == 0:
             return "0 B"
         
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.2f} {unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.2f} PB"
+        # L'unità deriva dal numero di bit: ogni 10 bit si passa all'unità successiva
+        exponent = min((int(size_bytes).bit_length() - 1) // 10, len(ReportFormatter.SIZE_UNITS) - 1)
+        return f"{size_bytes / (1 << (10 * exponent)):.2f} {ReportFormatter.SIZE_UNITS[exponent]}"
     
     @staticmethod
     def format_duration(seconds):
@@ -67,46 +75,52 @@ class ReportFormatter:
     @staticmethod
     def print_sync_report(report, duration, sync_id=None, resumed_from_id=None, dry_run=False):
         """Stampa il report finale della sincronizzazione"""
-        print("\n" + "="*60)
+        # Righe raccolte e scritte con un'unica print
+        lines = ["\n" + "="*60]
         if dry_run:
-            print("REPORT DRY-RUN COMPLETATO")
+            lines.append("REPORT DRY-RUN COMPLETATO")
         else:
-            print("REPORT SINCRONIZZAZIONE COMPLETATA")
-        print("="*60)
+            lines.append("REPORT SINCRONIZZAZIONE COMPLETATA")
+        lines.append("="*60)
         
-        print(f"Durata: {ReportFormatter.format_duration(duration.total_seconds())}")
+        lines.append(f"Durata: {ReportFormatter.format_duration(duration.total_seconds())}")
         
         if dry_run:
-            print(f"File che sarebbero trasferiti: {report.files_transferred}")
-            print(f"Duplicati che sarebbero trovati: {report.duplicates_found}")
-            print(f"Duplicati che sarebbero rinominati: {report.duplicates_renamed}")
-            print(f"File già elaborati (che sarebbero skippati): {report.already_processed}")
-            print(f"Dimensione totale che sarebbe trasferita: {ReportFormatter.format_size(report.total_size_transferred)}")
+            lines += [
+                f"File che sarebbero trasferiti: {report.files_transferred}",
+                f"Duplicati che sarebbero trovati: {report.duplicates_found}",
+                f"Duplicati che sarebbero rinominati: {report.duplicates_renamed}",
+                f"File già elaborati (che sarebbero skippati): {report.already_processed}",
+                f"Dimensione totale che sarebbe trasferita: {ReportFormatter.format_size(report.total_size_transferred)}",
+            ]
         else:
-            print(f"File trasferiti: {report.files_transferred}")
-            print(f"Duplicati trovati: {report.duplicates_found}")
-            print(f"Duplicati rinominati: {report.duplicates_renamed}")
-            print(f"File già elaborati (skippati): {report.already_processed}")
-            print(f"File saltati (errori): {report.skipped_files}")
-            print(f"Dimensione totale trasferita: {ReportFormatter.format_size(report.total_size_transferred)}")
+            lines += [
+                f"File trasferiti: {report.files_transferred}",
+                f"Duplicati trovati: {report.duplicates_found}",
+                f"Duplicati rinominati: {report.duplicates_renamed}",
+                f"File già elaborati (skippati): {report.already_processed}",
+                f"File saltati (errori): {report.skipped_files}",
+                f"Dimensione totale trasferita: {ReportFormatter.format_size(report.total_size_transferred)}",
+            ]
         
         if sync_id:
-            print(f"Database sync ID: {sync_id}")
+            lines.append(f"Database sync ID: {sync_id}")
         if resumed_from_id:
-            print(f"Ripresa da sync ID: {resumed_from_id}")
+            lines.append(f"Ripresa da sync ID: {resumed_from_id}")
         
-        if report.errors:
-            print(f"\nErrori ({len(report.errors)}):")
-            for error in report.errors[-5:]:  # Mostra ultimi 5 errori
-                print(f"  - {error}")
-            if len(report.errors) > 5:
-                print(f"  ... e altri {len(report.errors) - 5} errori (vedi database)")
+        if report.error_count:
+            lines.append(f"\nErrori ({report.error_count}):")
+            for error in list(report.errors)[-5:]:  # Mostra ultimi 5 errori
+                lines.append(f"  - {error}")
+            if report.error_count > 5:
+                lines.append(f"  ... e altri {report.error_count - 5} errori (vedi database)")
         
         if dry_run:
-            print("\n🔍 MODALITÀ DRY-RUN: Nessun file è stato trasferito realmente.")
-            print("   Esegui senza --dry-run per effettuare il trasferimento.")
+            lines.append("\n🔍 MODALITÀ DRY-RUN: Nessun file è stato trasferito realmente.")
+            lines.append("   Esegui senza --dry-run per effettuare il trasferimento.")
         
-        print("="*60)
+        lines.append("="*60)
+        print("\n".join(lines))
     
     @staticmethod
     def show_recent_reports(db_manager, limit=10):
@@ -6,15 +6,57 @@ Gestisce le connessioni SSH e i comandi remoti
 
 import logging
 import getpass
+import os
+import posixpath
+import shlex
+import shutil
+import tarfile
+import threading
 import paramiko
 from scp import SCPClient
 
+class GCMFirstTransport(paramiko.Transport):
+    """Transport che propone per primi i cifrari AES-GCM
+    
+    AES-GCM cifra e autentica in un solo passaggio (AES-NI + PCLMULQDQ),
+    senza l'HMAC separato richiesto da AES-CTR.
+    """
+    _preferred_ciphers = tuple(sorted(paramiko.Transport._preferred_ciphers, key=lambda cipher: 'gcm' not in cipher))
+
 class SSHManager:
+    # Dimensione dei blocchi scritti sul canale durante il trasferimento tar
+    TAR_BUFSIZE = 1024 * 1024
+    
+    # Blocchi letti dal file locale durante il caricamento SFTP
+    SFTP_BUFSIZE = 1024 * 1024
+    
+    # Finestra di flusso e pacchetto massimo dei canali SSH, intervallo keepalive della connessione.
+    # La finestra copre il prodotto banda-latenza (~12 MB a 1 Gbit/s con 100 ms di RTT);
+    # nel caso peggiore ogni canale aperto può bufferizzare fino a WINDOW_SIZE byte in memoria
+    WINDOW_SIZE = 2 ** 27
+    MAX_PACKET_SIZE = 2 ** 17
+    KEEPALIVE_INTERVAL = 30
+    
+    # Cifrari CBC e MAC legacy esclusi: la negoziazione ricade su AES-CTR/GCM
+    # e HMAC-SHA2, accelerati in hardware (AES-NI, ARMv8 Crypto) tramite OpenSSL
+    DISABLED_ALGORITHMS = {
+        'ciphers': ['aes128-cbc', 'aes192-cbc', 'aes256-cbc', '3des-cbc'],
+        'macs': ['hmac-sha1', 'hmac-sha1-96', 'hmac-md5', 'hmac-md5-96'],
+    }
+    
     def __init__(self, host, user, ssh_key_path=None):
         self.host = host
         self.user = user
         self.ssh_key_path = ssh_key_path
         self.ssh_client = None
+        # Un client SFTP per thread: i trasferimenti paralleli non condividono il canale
+        self.sftp_clients = {}
+        
+        # Directory remote già create in questa connessione: evitano un mkdir -p per file
+        self.known_remote_dirs = set()
+        
+        # uid e gid di www-data sul server, letti alla prima estrazione tar
+        self._www_data_ids = None
     
     def connect(self):
         """Stabilisce connessione SSH al server"""
@@ -22,19 +64,34 @@ class SSHManager:
             self.ssh_client = paramiko.SSHClient()
             self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             
+            # I file multimediali sono già compressi: la compressione SSH costerebbe solo CPU
+            connect_options = {
+                'username': self.user,
+                'compress': False,
+                'disabled_algorithms': self.DISABLED_ALGORITHMS,
+                'transport_factory': GCMFirstTransport,
+            }
+            
             if self.ssh_key_path:
                 self.ssh_client.connect(
                     self.host, 
-                    username=self.user, 
-                    key_filename=self.ssh_key_path
+                    key_filename=self.ssh_key_path,
+                    **connect_options
                 )
             else:
                 password = getpass.getpass(f"Password per {self.user}@{self.host}: ")
                 self.ssh_client.connect(
                     self.host, 
-                    username=self.user, 
-                    password=password
+                    password=password,
+                    **connect_options
                 )
+            
+            # Una sola connessione per tutta la sincronizzazione: finestra ampia e keepalive
+            transport = self.ssh_client.get_transport()
+            transport.default_window_size = self.WINDOW_SIZE
+            transport.default_max_packet_size = self.MAX_PACKET_SIZE
+            transport.set_keepalive(self.KEEPALIVE_INTERVAL)
+            logging.debug(f"Cifrario SSH negoziato: {transport.local_cipher}")
                 
             logging.info(f"Connessione SSH stabilita con {self.host}")
             return True
@@ -45,18 +102,26 @@ class SSHManager:
     
     def disconnect(self):
         """Chiude la connessione SSH"""
+        for sftp in self.sftp_clients.values():
+            sftp.close()
+        self.sftp_clients.clear()
         if self.ssh_client:
             self.ssh_client.close()
             self.ssh_client = None
+            self.known_remote_dirs.clear()
+            self._www_data_ids = None
             logging.info("Connessione SSH chiusa")
     
-    def execute_command(self, command, timeout=300):
-        """Esegue un comando SSH e ritorna il risultato"""
+    def execute_command(self, command, timeout=300, input_data=None):
+        """Esegue un comando SSH e ritorna il risultato (input_data: byte da inviare su stdin)"""
         if not self.ssh_client:
             raise Exception("Connessione SSH non attiva")
         
         try:
             stdin, stdout, stderr = self.ssh_client.exec_command(command, timeout=timeout)
+            if input_data is not None:
+                stdin.channel.sendall(input_data)
+                stdin.channel.shutdown_write()
             exit_status = stdout.channel.recv_exit_status()
             output = stdout.read().decode()
             error = stderr.read().decode()
@@ -88,7 +153,7 @@ class SSHManager:
     def file_exists(self, remote_path):
         """Verifica se un file esiste sul server remoto"""
         try:
-            result = self.execute_command(f"test -f '{remote_path}' && echo 'exists' || echo 'not_exists'")
+            result = self.execute_command(f"test -f {shlex.quote(str(remote_path))} && echo 'exists' || echo 'not_exists'")
             return result['output'] == 'exists'
         except Exception:
             return False
@@ -100,11 +165,11 @@ class SSHManager:
         
         # Se siamo già root, usiamo direttamente su
         if self.user == 'root':
-            su_command = f"su -c '{command}' www-data"
+            su_command = f"su -c {shlex.quote(command)} www-data"
         else:
             # Se non siamo root, dobbiamo prima diventare root, poi www-data
             # Prova prima con sudo
-            su_command = f"sudo su -c '{command}' www-data"
+            su_command = f"sudo su -c {shlex.quote(command)} www-data"
         
         try:
             _, stdout, stderr = self.ssh_client.exec_command(su_command, timeout=timeout)
@@ -116,7 +181,8 @@ class SSHManager:
             if exit_status != 0 and self.user != 'root' and 'sudo' in error:
                 logging.debug("Sudo fallito, tentativo con su root...")
                 # Questo richiederà la password root interattivamente
-                su_command = f"su -c 'su -c \"{command}\" www-data' root"
+                inner = f"su -c {shlex.quote(command)} www-data"
+                su_command = f"su -c {shlex.quote(inner)} root"
                 _, stdout, stderr = self.ssh_client.exec_command(su_command, timeout=timeout)
                 exit_status = stdout.channel.recv_exit_status()
                 output = stdout.read().decode()
@@ -132,6 +198,29 @@ class SSHManager:
             logging.error(f"Errore esecuzione comando come www-data '{command}': {e}")
             raise
 
+    def ensure_remote_directories(self, remote_dirs, batch_size=500):
+        """Crea più directory remote con un solo mkdir -p per blocco di percorsi"""
+        missing = sorted({str(remote_dir) for remote_dir in remote_dirs} - self.known_remote_dirs)
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            quoted = ' '.join(shlex.quote(remote_dir) for remote_dir in chunk)
+            result = self.execute_command(f"mkdir -p {quoted}")
+            if result['exit_status'] != 0:
+                logging.warning(f"Impossibile creare alcune directory remote: {result['error']}")
+                continue
+            self.known_remote_dirs.update(chunk)
+    
+    def get_sftp(self):
+        """Restituisce il client SFTP del thread corrente, aprendolo una sola volta"""
+        if not self.ssh_client:
+            raise Exception("Connessione SSH non attiva")
+        
+        thread_id = threading.get_ident()
+        sftp = self.sftp_clients.get(thread_id)
+        if sftp is None:
+            sftp = self.sftp_clients[thread_id] = self.ssh_client.open_sftp()
+        return sftp
+    
     def transfer_file_as_www_data(self, local_path, remote_path):
         """Trasferisce un file e gestisce proprietario www-data"""
         if not self.ssh_client:
@@ -140,16 +229,26 @@ class SSHManager:
         try:
             # Prima crea la directory di destinazione normalmente
             remote_dir = str(remote_path).rsplit('/', 1)[0]
-            mkdir_result = self.execute_command(f"mkdir -p '{remote_dir}'")
-            if mkdir_result['exit_status'] != 0:
-                logging.warning(f"Impossibile creare directory {remote_dir}: {mkdir_result['error']}")
+            if remote_dir not in self.known_remote_dirs:
+                mkdir_result = self.execute_command(f"mkdir -p {shlex.quote(remote_dir)}")
+                if mkdir_result['exit_status'] != 0:
+                    logging.warning(f"Impossibile creare directory {remote_dir}: {mkdir_result['error']}")
+                else:
+                    self.known_remote_dirs.add(remote_dir)
             
-            # Trasferisce il file normalmente con l'utente connesso
-            with SCPClient(self.ssh_client.get_transport()) as scp:
-                scp.put(str(local_path), str(remote_path))
+            # Trasferisce il file normalmente con l'utente connesso, sul canale SFTP del thread.
+            # Scritture in pipeline: nessuna attesa di conferma per blocco, eventuali errori
+            # emergono alla chiusura, e nessuno stat finale come in sftp.put
+            with open(local_path, 'rb') as local_file, \
+                    self.get_sftp().open(str(remote_path), 'wb') as remote_file:
+                remote_file.set_pipelined(True)
+                shutil.copyfileobj(local_file, remote_file, self.SFTP_BUFSIZE)
+                # Stesso mtime del file locale, come con tar: la scansione successiva riusa l'hash
+                local_stat = os.fstat(local_file.fileno())
+                remote_file.utime((local_stat.st_atime, local_stat.st_mtime))
             
             # Cambia proprietario a www-data usando sudo/su root
-            chown_result = self.execute_as_www_data(f"chown www-data:www-data '{remote_path}'")
+            chown_result = self.execute_as_www_data(f"chown www-data:www-data {shlex.quote(str(remote_path))}")
             if chown_result['exit_status'] != 0:
                 logging.warning(f"Attenzione: impossibile cambiare proprietario per {remote_path}")
                 logging.warning(f"Errore: {chown_result['error']}")
@@ -164,10 +263,98 @@ class SSHManager:
             logging.error(f"Errore trasferimento file {local_path} -> {remote_path}: {e}")
             return False
 
+    def transfer_files_as_tar(self, files, remote_root):
+        """Trasferisce più file in un unico flusso tar su SSH
+        
+        files è una lista di coppie (percorso locale, percorso remoto sotto remote_root).
+        Le voci dell'archivio hanno proprietario www-data: estraendo come root
+        tar lo applica direttamente, senza chown file per file.
+        """
+        if not self.ssh_client:
+            raise Exception("Connessione SSH non attiva")
+        
+        remote_root = str(remote_root)
+        www_data_ids = None
+        
+        def set_owner(tarinfo):
+            tarinfo.uname = tarinfo.gname = 'www-data'
+            if www_data_ids:
+                tarinfo.uid, tarinfo.gid = www_data_ids
+            return tarinfo
+        
+        channel = None
+        try:
+            www_data_ids = self.get_www_data_ids()
+            channel = self.ssh_client.get_transport().open_session()
+            quoted_root = shlex.quote(remote_root)
+            channel.exec_command(f"mkdir -p {quoted_root} && tar -xf - -C {quoted_root}")
+            
+            # Un solo flusso per tutti i file: nessun round-trip per file
+            stream = channel.makefile('wb')
+            with tarfile.open(fileobj=stream, mode='w|', bufsize=self.TAR_BUFSIZE, dereference=True) as tar:
+                # Legge ogni file a blocchi da 1 MiB invece dei 16 KiB predefiniti
+                tar.copybufsize = self.TAR_BUFSIZE
+                for local_path, remote_path in files:
+                    arcname = posixpath.relpath(str(remote_path), remote_root)
+                    tar.add(str(local_path), arcname=arcname, recursive=False, filter=set_owner)
+            stream.flush()
+            channel.shutdown_write()
+            
+            exit_status = channel.recv_exit_status()
+            if exit_status != 0:
+                error = channel.makefile_stderr('rb').read().decode(errors='replace').strip()
+                logging.error(f"Errore estrazione tar remota ({exit_status}): {error}")
+                return False
+            
+            # tar ha creato le directory dei file estratti
+            self.known_remote_dirs.update(str(remote_path).rsplit('/', 1)[0] for _, remote_path in files)
+        
+        except Exception as e:
+            logging.error(f"Errore trasferimento tar verso {remote_root}: {e}")
+            return False
+        
+        finally:
+            if channel is not None:
+                channel.close()
+        
+        # Solo root può far applicare a tar il proprietario: altrimenti chown come per i file singoli.
+        # I file sono già estratti: un errore qui non rende fallito il trasferimento
+        if self.user != 'root':
+            try:
+                self._chown_www_data([remote_path for _, remote_path in files])
+            except Exception as e:
+                logging.warning(f"Attenzione: impossibile cambiare proprietario dei file estratti: {e}")
+        
+        logging.debug(f"Trasferiti {len(files)} file via tar in {remote_root}")
+        return True
+    
+    def get_www_data_ids(self):
+        """Ritorna (uid, gid) di www-data sul server, o None se non risolvibili"""
+        if self._www_data_ids is None:
+            try:
+                result = self.execute_command("id -u www-data && id -g www-data")
+                if result['exit_status'] == 0:
+                    uid, gid = map(int, result['output'].split())
+                    self._www_data_ids = (uid, gid)
+                else:
+                    logging.warning(f"Utente www-data non trovato sul server: {result['error']}")
+            except ValueError:
+                logging.warning(f"Risposta inattesa risolvendo www-data: {result['output']}")
+        return self._www_data_ids
+    
+    def _chown_www_data(self, remote_paths, batch_size=500):
+        """Imposta il proprietario www-data su più file con un chown per blocco di percorsi"""
+        for start in range(0, len(remote_paths), batch_size):
+            quoted = ' '.join(shlex.quote(str(remote_path)) for remote_path in remote_paths[start:start + batch_size])
+            chown_result = self.execute_as_www_data(f"chown www-data:www-data {quoted}")
+            if chown_result['exit_status'] != 0:
+                logging.warning(f"Attenzione: impossibile cambiare proprietario per alcuni file: {chown_result['error']}")
+                logging.info("I file sono stati trasferiti ma potrebbero avere proprietario sbagliato")
+    
     def check_www_data_access(self, remote_path):
         """Verifica se www-data può accedere al percorso remoto"""
         try:
-            result = self.execute_as_www_data(f"test -w '{remote_path}' && echo 'writable' || echo 'not_writable'")
+            result = self.execute_as_www_data(f"test -w {shlex.quote(str(remote_path))} && echo 'writable' || echo 'not_writable'")
             return result['exit_status'] == 0 and result['output'] == 'writable'
         except Exception:
             return False
@@ -179,6 +366,9 @@ class SSHManager:
 class NextcloudCommands:
     """Classe per gestire i comandi specifici di Nextcloud"""
     
+    # Prefisso delle righe che riportano l'esito di ogni comando in uno script remoto
+    STEP_MARKER = "__STEP__:"
+    
     def __init__(self, ssh_manager, nextcloud_path="/var/www/nextcloud"):
         self.ssh_manager = ssh_manager
         self.nextcloud_path = nextcloud_path
@@ -233,23 +423,8 @@ class NextcloudCommands:
             logging.info(f"[DRY-RUN] Impostazione permessi file per {target_path}")
             return True
         
-        try:
-            # Permessi file
-            logging.info("Impostando permessi file (644)...")
-            result = self.ssh_manager.execute_command(
-                f"find '{target_path}' -type f -exec chmod 644 {{}} +",
-                timeout=600
-            )
-            
-            if result['exit_status'] != 0:
-                logging.error(f"Errore impostazione permessi file: {result['error']}")
-                return False
-            
-            return True
-            
-        except Exception as e:
-            logging.error(f"Errore impostazione permessi file: {e}")
-            return False
+        logging.info("Impostando permessi file (644)...")
+        return self._run_permission_steps(self._permission_steps(target_path)[:1])
     
     def set_directory_permissions(self, target_path, dry_run=False):
         """Imposta i permessi corretti sulle directory"""
@@ -257,45 +432,100 @@ class NextcloudCommands:
             logging.info(f"[DRY-RUN] Impostazione permessi directory per {target_path}")
             return True
         
+        logging.info("Impostando permessi directory (755)...")
+        return self._run_permission_steps(self._permission_steps(target_path)[1:2])
+    
+    def set_ownership(self, target_path, owner="www-data", group="www-data", dry_run=False):
+        """Imposta la proprietà corretta sui file"""
+        if dry_run:
+            logging.info(f"[DRY-RUN] Impostazione proprietà {owner}:{group} per {target_path}")
+            return True
+        
+        logging.info(f"Impostando proprietà {owner}:{group}...")
+        return self._run_permission_steps(self._permission_steps(target_path, owner, group)[2:])
+    
+    def set_permissions(self, target_path, owner="www-data", group="www-data", dry_run=False, paths=None):
+        """Imposta permessi di file e directory e proprietà con un unico comando remoto
+        
+        Con paths (file e directory toccati dalla sincronizzazione) agisce solo su
+        quei percorsi invece di riattraversare l'intero albero di destinazione.
+        """
+        if dry_run:
+            logging.info(f"[DRY-RUN] Impostazione permessi e proprietà {owner}:{group} per {target_path}")
+            return True
+        
+        if paths is not None:
+            return self._set_permissions_on_paths(paths, owner, group)
+        
+        logging.info("Impostando permessi (644/755) e proprietà...")
+        return self._run_permission_steps(self._permission_steps(target_path, owner, group))
+    
+    @staticmethod
+    def _permission_steps(target_path, owner="www-data", group="www-data"):
+        """Passi della sistemazione completa dell'albero: permessi file, directory e proprietà"""
+        quoted_path = shlex.quote(str(target_path))
+        return [
+            ("Permessi file (644)", f"find {quoted_path} -type f -exec chmod 644 {{}} +"),
+            ("Permessi directory (755)", f"find {quoted_path} -type d -exec chmod 755 {{}} +"),
+            (f"Proprietà {owner}:{group}", f"chown -R {owner}:{group} {quoted_path}"),
+        ]
+    
+    def _run_permission_steps(self, commands):
+        """Esegue i passi indicati in un unico comando remoto, riportando quelli falliti"""
+        # Un solo canale SSH per tutti i passi: ogni comando è seguito da un
+        # marcatore con il suo exit status, così l'esito resta distinto per passo
+        script = '; '.join(
+            f"{command}; echo \"{self.STEP_MARKER}{index} $?\""
+            for index, (_, command) in enumerate(commands)
+        )
+        
         try:
-            # Permessi directory
-            logging.info("Impostando permessi directory (755)...")
-            result = self.ssh_manager.execute_command(
-                f"find '{target_path}' -type d -exec chmod 755 {{}} +",
-                timeout=600
-            )
+            result = self.ssh_manager.execute_command(script, timeout=1800)
             
-            if result['exit_status'] != 0:
-                logging.error(f"Errore impostazione permessi directory: {result['error']}")
-                return False
+            statuses = {}
+            for line in result['output'].splitlines():
+                if line.startswith(self.STEP_MARKER):
+                    index, exit_status = line[len(self.STEP_MARKER):].split()
+                    statuses[int(index)] = int(exit_status)
             
+            failed_steps = [step_name for index, (step_name, _) in enumerate(commands) if statuses.get(index) != 0]
+            if failed_steps:
+                logging.error(f"Errore {', '.join(failed_steps)}: {result['error']}")
+                return False
             return True
             
         except Exception as e:
-            logging.error(f"Errore impostazione permessi directory: {e}")
+            logging.error(f"Errore impostazione permessi: {e}")
             return False
     
-    def set_ownership(self, target_path, owner="www-data", group="www-data", dry_run=False):
-        """Imposta la proprietà corretta sui file"""
-        if dry_run:
-            logging.info(f"[DRY-RUN] Impostazione proprietà {owner}:{group} per {target_path}")
+    def _set_permissions_on_paths(self, paths, owner, group):
+        """Imposta permessi e proprietà dei soli percorsi indicati, passati via stdin"""
+        if not paths:
             return True
         
+        # find con -maxdepth 0 valuta solo i percorsi ricevuti, distinguendo file e
+        # directory; xargs li raggruppa così da usare poche invocazioni
+        script = (
+            "find \"$@\" -maxdepth 0 \\( -type f -exec chmod 644 {} + \\) "
+            "-o \\( -type d -exec chmod 755 {} + \\); status=$?; "
+            f"chown {owner}:{group} \"$@\" || status=$?; exit $status"
+        )
+        command = f"xargs -0 -r sh -c {shlex.quote(script)} sh"
+        
         try:
-            logging.info(f"Impostando proprietà {owner}:{group}...")
+            logging.info(f"Impostando permessi (644/755) e proprietà su {len(paths)} percorsi...")
+            # os.fsencode restituisce i byte originali anche dei nomi non UTF-8
             result = self.ssh_manager.execute_command(
-                f"chown -R {owner}:{group} '{target_path}'",
-                timeout=600
+                command, timeout=1800,
+                input_data=b'\0'.join(map(os.fsencode, paths))
             )
-            
             if result['exit_status'] != 0:
-                logging.error(f"Errore impostazione proprietà: {result['error']}")
+                logging.error(f"Errore permessi e proprietà: {result['error']}")
                 return False
-            
             return True
-            
+        
         except Exception as e:
-            logging.error(f"Errore impostazione proprietà: {e}")
+            logging.error(f"Errore impostazione permessi: {e}")
             return False
     
     def scan_files(self, dry_run=False):
@@ -325,13 +555,14 @@ class NextcloudCommands:
             logging.error(f"Errore scansione file: {e}")
             return False
     
-    def execute_post_sync_commands(self, target_path, dry_run=False):
+    def execute_post_sync_commands(self, target_path, dry_run=False, touched_paths=None):
         """Esegue tutti i comandi post-sincronizzazione"""
         if dry_run:
             logging.info("[DRY-RUN] COMANDI POST-SINCRONIZZAZIONE SIMULATI:")
-            logging.info(f"[DRY-RUN] find '{target_path}' -type f -exec chmod 644 {{}} +")
-            logging.info(f"[DRY-RUN] find '{target_path}' -type d -exec chmod 755 {{}} +")
-            logging.info(f"[DRY-RUN] chown -R www-data:www-data '{target_path}'")
+            quoted_path = shlex.quote(str(target_path))
+            logging.info(f"[DRY-RUN] find {quoted_path} -type f -exec chmod 644 {{}} +")
+            logging.info(f"[DRY-RUN] find {quoted_path} -type d -exec chmod 755 {{}} +")
+            logging.info(f"[DRY-RUN] chown -R www-data:www-data {quoted_path}")
             logging.info("[DRY-RUN] su -c \"php /var/www/nextcloud/occ files:scan --all\" www-data -s /bin/bash")
             logging.info("[DRY-RUN] Configurazione cache Nextcloud")
             return True
@@ -341,9 +572,7 @@ class NextcloudCommands:
         # Lista dei passaggi da eseguire
         steps = [
             ("Correzione cache", lambda: self.check_and_fix_cache(dry_run)),
-            ("Permessi file", lambda: self.set_file_permissions(target_path, dry_run)),
-            ("Permessi directory", lambda: self.set_directory_permissions(target_path, dry_run)),
-            ("Proprietà file", lambda: self.set_ownership(target_path, dry_run=dry_run)),
+            ("Permessi e proprietà", lambda: self.set_permissions(target_path, dry_run=dry_run, paths=touched_paths)),
             ("Scansione Nextcloud", lambda: self.scan_files(dry_run))
         ]
         
@@ -5,7 +5,13 @@ Coordina tutte le operazioni di sincronizzazione
 """
 
 import logging
-from datetime import datetime
+import logging.handlers
+import os
+import posixpath
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 from pathlib import Path
 
 from database_manager import DatabaseManager
@@ -14,8 +20,24 @@ from file_utils import FileUtils, DuplicateChecker, FileScanner
 from ssh_manager import SSHManager, NextcloudCommands
 
 class NextcloudMediaSync:
+    # Trasferimento in blocco via tar: numero minimo di file per usarlo e limiti di un blocco
+    TAR_MIN_FILES = 16
+    TAR_BATCH_FILES = 200
+    TAR_BATCH_BYTES = 512 * 1024 * 1024
+    
+    # File per blocco i cui hash sono calcolati in parallelo prima del trasferimento
+    HASH_PREFETCH = 256
+    
+    # Secondi minimi tra due righe di avanzamento nel log
+    PROGRESS_LOG_INTERVAL = 10.0
+    
+    # Trasferimenti SFTP singoli eseguiti in parallelo, ognuno sul proprio canale
+    DEFAULT_UPLOAD_WORKERS = 4
+    
     def __init__(self, nextcloud_host, nextcloud_user, nextcloud_dest_path, 
-                 local_source_path, ssh_key_path=None, extensions=None, db_path=None, dry_run=False):
+                 local_source_path, ssh_key_path=None, extensions=None, db_path=None, dry_run=False,
+                 hash_algorithm=FileUtils.DEFAULT_HASH_ALGORITHM, drop_page_cache=False,
+                 upload_workers=DEFAULT_UPLOAD_WORKERS, skip_history=False):
         """
         Inizializza il sincronizzatore
         
@@ -28,16 +50,26 @@ class NextcloudMediaSync:
             extensions: lista delle estensioni da sincronizzare
             db_path: percorso del database SQLite
             dry_run: se True, simula le operazioni senza trasferire file
+            hash_algorithm: algoritmo di hash per il rilevamento duplicati (md5, sha256, blake3, xxh128 o auto)
+            drop_page_cache: se True, libera la page cache dei file dopo averli elaborati
+            upload_workers: numero di trasferimenti SFTP paralleli quando non si usa tar
+            skip_history: se True, salta i file già elaborati nelle sincronizzazioni precedenti
         """
         self.nextcloud_host = nextcloud_host
         self.nextcloud_user = nextcloud_user
         self.nextcloud_dest_path = Path(nextcloud_dest_path)
         self.local_source_path = Path(local_source_path)
+        self._dest_path_str = str(self.nextcloud_dest_path)
+        self._dest_path_quoted = shlex.quote(self._dest_path_str)
         self.ssh_key_path = ssh_key_path
         self.dry_run = dry_run
+        self.hash_algorithm = hash_algorithm
+        self.drop_page_cache = drop_page_cache
+        self.upload_workers = max(1, upload_workers)
+        self.skip_history = skip_history
         
         # Estensioni multimediali supportate
-        self.extensions = extensions or FileUtils.MEDIA_EXTENSIONS
+        self.extensions = FileUtils.normalize_extensions(extensions)
         
         # Componenti del sistema
         self.db = DatabaseManager(db_path or "nextcloud_sync.db")
@@ -50,6 +82,21 @@ class NextcloudMediaSync:
         self.sync_id = None
         self.resumed_from_id = None
         
+        # File in attesa del trasferimento in blocco (tar o SFTP paralleli)
+        self.use_tar_batches = False
+        self._transfer_batch = []
+        self._transfer_batch_bytes = 0
+        self._reserved_remote_paths = set()
+        
+        # File remoti scritti in questa esecuzione: i permessi finali si applicano solo a loro
+        self._touched_remote_files = []
+        
+        # Hash calcolati in anticipo dal pool di thread: {percorso: (hash, dimensione)}
+        self._prehashed = {}
+        
+        # Pool dei trasferimenti singoli, creato alla prima necessità
+        self._upload_executor = None
+        
         # Setup logging
         self._setup_logging()
         
@@ -68,11 +115,24 @@ class NextcloudMediaSync:
             level=log_level,
             format=log_format,
             handlers=[
-                logging.FileHandler('nextcloud_sync.log'),
+                self.create_log_file_handler(log_format),
                 logging.StreamHandler()
             ]
         )
     
+    @staticmethod
+    def create_log_file_handler(log_format):
+        """Crea l'handler del file di log, scritto a blocchi: un write ogni 1024 record o al primo warning"""
+        # Il formato va sul FileHandler: il MemoryHandler passa i record senza formattarli
+        file_handler = logging.FileHandler('nextcloud_sync.log')
+        file_handler.setFormatter(logging.Formatter(log_format))
+        
+        return logging.handlers.MemoryHandler(
+            capacity=1024,
+            flushLevel=logging.WARNING,
+            target=file_handler
+        )
+    
     def check_for_resume(self):
         """Controlla se esiste una sincronizzazione interrotta da riprendere"""
         incomplete_sync_id = self.db.find_incomplete_sync(self.local_source_path, self.nextcloud_dest_path)
@@ -92,7 +152,7 @@ class NextcloudMediaSync:
                 # Includi anche i file della sessione interrotta se completati
                 self.duplicate_checker.load_interrupted_files([incomplete_sync_id])
                 
-                logging.info(f"Ripresa sincronizzazione: {len(self.duplicate_checker.processed_files)} file già elaborati verranno skippati")
+                logging.info(f"Ripresa sincronizzazione: {self.duplicate_checker.processed_count} file già elaborati verranno skippati")
                 return True
             else:
                 # Marca come interrotta definitivamente
@@ -125,8 +185,9 @@ class NextcloudMediaSync:
                 logging.info(f"File già elaborato, skipping: {local_file_path}")
                 return True
             
-            # Calcola hash del file locale
-            file_hash = FileUtils.calculate_file_hash(local_file_path)
+            # Calcola hash del file locale (riusato dalla cache se il file non è cambiato)
+            prehashed = self._prehashed.pop(local_file_path, None)
+            file_hash, file_size = prehashed or self._hash_local_file(local_file_path)
             if not file_hash:
                 self.report.add_error(f"Impossibile calcolare hash per {local_file_path}")
                 if self.sync_id:
@@ -137,12 +198,13 @@ class NextcloudMediaSync:
             if self.duplicate_checker.is_file_already_processed(local_file_path, file_hash):
                 self.report.add_already_processed()
                 logging.info(f"File già elaborato (hash match), skipping: {local_file_path}")
+                if self.drop_page_cache:
+                    FileUtils.drop_page_cache(local_file_path)
                 return True
             
             # Calcola percorso di destinazione
             relative_path = FileUtils.get_relative_path(local_file_path, self.local_source_path)
-            remote_dest_path = self.nextcloud_dest_path / relative_path
-            file_size = local_file_path.stat().st_size
+            remote_dest_path = posixpath.join(self._dest_path_str, relative_path)
             
             if self.dry_run:
                 return self._simulate_transfer(local_file_path, remote_dest_path, file_hash, file_size)
@@ -166,19 +228,48 @@ class NextcloudMediaSync:
                 self.db.log_error(self.sync_id, f"Trasferimento: {e}", local_file_path)
             return False
     
+    def _hash_local_file(self, local_file_path):
+        """Restituisce hash e dimensione del file, ricalcolando l'hash solo se size o mtime sono cambiati"""
+        try:
+            file_stat = os.stat(local_file_path)
+        except OSError as e:
+            logging.error(f"Impossibile leggere {local_file_path}: {e}")
+            return None, 0
+        
+        file_hash = self.db.get_cached_file_hash(file_stat, self.hash_algorithm)
+        if file_hash is None:
+            file_hash = FileUtils.calculate_file_hash(local_file_path, algorithm=self.hash_algorithm)
+            if file_hash:
+                self.db.cache_file_hash(file_stat, self.hash_algorithm, file_hash)
+        return file_hash, file_stat.st_size
+    
+    def _prehash_files(self, local_files):
+        """Calcola in parallelo gli hash dei file non ancora elaborati"""
+        candidates = [
+            local_file for local_file in local_files
+            if not self.duplicate_checker.is_file_already_processed(local_file)
+        ]
+        for local_file, result in FileUtils.hash_files_parallel(candidates, self._hash_local_file):
+            self._prehashed[local_file] = result
+        
+        # Con la cache remota su database, i possibili duplicati del blocco si risolvono in una query
+        self.duplicate_checker.resolve_remote_hashes(
+            self._prehashed[local_file][0] for local_file in candidates
+        )
+    
     def _simulate_transfer(self, local_file_path, remote_dest_path, file_hash, file_size):
         """Simula il trasferimento di un file (modalità dry-run)"""
         logging.info(f"[DRY-RUN] TRASFERIMENTO SIMULATO: {local_file_path}")
         logging.info(f"[DRY-RUN] Destinazione: {remote_dest_path}")
         logging.info(f"[DRY-RUN] Dimensione: {ReportFormatter.format_size(file_size)}")
-        logging.info(f"[DRY-RUN] Hash MD5: {file_hash}")
+        logging.info(f"[DRY-RUN] Hash {self.hash_algorithm.upper()}: {file_hash}")
         
         # Simula controllo duplicati
         is_duplicate = self.duplicate_checker.is_duplicate_in_remote(file_hash)
         if is_duplicate:
             existing_file = self.duplicate_checker.get_existing_duplicate_path(file_hash)
             logging.info(f"[DRY-RUN] DUPLICATO RILEVATO: esiste già come {existing_file}")
-            final_remote_path = FileUtils.generate_duplicate_name(None, remote_dest_path, dry_run=True)
+            final_remote_path = FileUtils.generate_duplicate_name(None, remote_dest_path, dry_run=True, file_hash=file_hash)
             logging.info(f"[DRY-RUN] Sarebbe rinominato come: {final_remote_path}")
             self.report.add_duplicate()
             self.report.add_renamed_duplicate()
@@ -187,7 +278,7 @@ class NextcloudMediaSync:
             self.report.add_transferred(file_size)
         
         # Simula trasferimento ottimizzato come www-data
-        final_remote_path = FileUtils.generate_duplicate_name(None, remote_dest_path, dry_run=True) if is_duplicate else remote_dest_path
+        final_remote_path = FileUtils.generate_duplicate_name(None, remote_dest_path, dry_run=True, file_hash=file_hash) if is_duplicate else remote_dest_path
         self.transfer_file_optimized(local_file_path, final_remote_path)  # Simula trasferimento ottimizzato
         
         # Simula aggiornamento cache
@@ -217,18 +308,111 @@ class NextcloudMediaSync:
             
             # Genera nome per duplicato
             final_remote_path = FileUtils.generate_duplicate_name(
-                self.ssh_manager.get_client(), remote_dest_path
+                self.ssh_manager.get_client(), remote_dest_path,
+                reserved=self._reserved_remote_paths, file_hash=file_hash
             )
             self.report.add_renamed_duplicate()
             logging.info(f"File sarà salvato come duplicato: {final_remote_path}")
         
-        # Trasferimento ottimizzato direttamente come www-data
-        if not self.transfer_file_optimized(local_file_path, final_remote_path):
-            self.report.add_error(f"Trasferimento ottimizzato fallito per {local_file_path}")
-            return False
+        # Il file parte con il blocco: via tar oppure insieme agli altri in parallelo
+        self._queue_transfer(local_file_path, final_remote_path, file_hash, file_size, is_duplicate)
+        return True
+    
+    def _queue_transfer(self, local_file_path, final_remote_path, file_hash, file_size, is_duplicate):
+        """Accoda un file al prossimo blocco (inviato da sync_files quando è pieno)"""
+        # Hash e percorso sono registrati subito: i file successivi dello stesso
+        # blocco devono già vederli per il controllo duplicati
+        self.duplicate_checker.add_remote_file_hash(file_hash, str(final_remote_path))
+        self._reserved_remote_paths.add(str(final_remote_path))
+        self._transfer_batch.append((local_file_path, final_remote_path, file_hash, file_size, is_duplicate))
+        self._transfer_batch_bytes += file_size
+    
+    def _transfer_batch_full(self):
+        """Indica se il blocco in coda ha raggiunto il numero di file o la dimensione massima"""
+        return (len(self._transfer_batch) >= self.TAR_BATCH_FILES
+                or self._transfer_batch_bytes >= self.TAR_BATCH_BYTES)
+    
+    def _flush_transfer_batch(self):
+        """Invia i file accodati in un unico flusso tar, oppure file per file in parallelo
+        
+        Se l'invio si interrompe (per esempio per una connessione caduta) tutti i file
+        del blocco non ancora registrati risultano falliti.
+        """
+        batch = self._transfer_batch
+        self._transfer_batch = []
+        self._transfer_batch_bytes = 0
+        self._reserved_remote_paths.clear()
+        if not batch:
+            return
+        
+        # File del blocco non ancora registrati come trasferiti o falliti
+        pending = {item[0]: item for item in batch}
+        try:
+            self._send_transfer_batch(pending)
+        except Exception as e:
+            logging.error(f"Errore trasferimento blocco di {len(pending)} file: {e}")
+            for item in pending.values():
+                self._fail_transfer(item, e)
+    
+    def _send_transfer_batch(self, pending):
+        """Trasferisce i file in pending, togliendo ognuno una volta registrato"""
+        batch = list(pending.values())
+        
+        if self.use_tar_batches:
+            files = [(local_file_path, final_remote_path) for local_file_path, final_remote_path, *_ in batch]
+            if self.ssh_manager.transfer_files_as_tar(files, self.nextcloud_dest_path):
+                for item in batch:
+                    self._complete_transfer(*pending.pop(item[0]))
+                return
+            
+            logging.warning(f"Trasferimento tar fallito, ripiego su trasferimento singolo per {len(batch)} file")
+            self.ssh_manager.ensure_remote_directories(
+                posixpath.dirname(str(final_remote_path)) for _, final_remote_path, *_ in batch
+            )
         
-        # Aggiorna cache hash
+        # Le decisioni sui duplicati sono già prese: i caricamenti sono indipendenti
+        # e procedono in parallelo, mentre report e database restano nel thread principale
+        if self._upload_executor is None:
+            self._upload_executor = ThreadPoolExecutor(max_workers=self.upload_workers)
+        futures = {
+            self._upload_executor.submit(self.transfer_file_optimized, item[0], item[1]): item
+            for item in batch
+        }
+        for future in as_completed(futures):
+            item = pending.pop(futures[future][0])
+            if future.exception() is None and future.result():
+                self._complete_transfer(*item)
+            else:
+                self._fail_transfer(item, future.exception() or "caricamento non riuscito")
+    
+    def _fail_transfer(self, item, error):
+        """Registra un file del blocco non trasferito"""
+        local_file_path, final_remote_path, file_hash, file_size, is_duplicate = item
+        
+        # Il contenuto non è arrivato sul server: non deve far rinominare i file successivi
+        if not is_duplicate:
+            self.duplicate_checker.discard_remote_file_hash(file_hash)
+        
+        logging.error(f"Trasferimento fallito {local_file_path}: {error}")
+        self.report.add_error(f"Trasferimento fallito {local_file_path}: {error}")
+        self.report.add_skipped()
+        if self.sync_id:
+            self.db.log_error(self.sync_id, f"Trasferimento: {error}", local_file_path)
+    
+    def _complete_transfer(self, local_file_path, final_remote_path, file_hash, file_size, is_duplicate):
+        """Registra un file trasferito con successo"""
+        # Aggiorna cache hash ed elenco remoto salvato (nessuna nuova scansione per saperlo).
+        # Con dimensione e mtime (secondi interi, conservati da tar e SFTP) la prossima
+        # scansione riusa l'hash senza ricalcolarlo sul server
         self.duplicate_checker.add_remote_file_hash(file_hash, str(final_remote_path))
+        try:
+            mtime = str(int(os.stat(local_file_path).st_mtime))
+        except OSError:
+            mtime = None
+        self.db.add_remote_index_entry(
+            self.nextcloud_dest_path, self.hash_algorithm, final_remote_path, file_hash, file_size, mtime
+        )
+        self._touched_remote_files.append(str(final_remote_path))
         
         # Statistiche
         if not is_duplicate:
@@ -242,7 +426,28 @@ class NextcloudMediaSync:
             )
         
         logging.info(f"Trasferito: {local_file_path} -> {final_remote_path}")
-        return True
+        
+        # File caricato: le sue pagine non serviranno più
+        if self.drop_page_cache:
+            FileUtils.drop_page_cache(local_file_path)
+    
+    def _touched_remote_paths(self):
+        """File toccati in questa esecuzione più le loro directory fino alla destinazione
+        
+        Ritorna None per una sincronizzazione ripresa: i file caricati nelle esecuzioni
+        interrotte non sono tracciati, quindi serve la sistemazione dell'intero albero.
+        """
+        if self.resumed_from_id:
+            return None
+        
+        directories = {self._dest_path_str}
+        for remote_path in self._touched_remote_files:
+            parent = posixpath.dirname(remote_path)
+            while parent not in directories and len(parent) > len(self._dest_path_str):
+                directories.add(parent)
+                parent = posixpath.dirname(parent)
+        
+        return self._touched_remote_files + sorted(directories)
     
     def perform_dry_run_checks(self):
         """Esegue tutte le verifiche necessarie per il dry-run"""
@@ -270,7 +475,7 @@ class NextcloudMediaSync:
                 # 3. Verifica esistenza e accesso directory destinazione con www-data
                 logging.info("3/5 Verifica directory destinazione e accesso www-data...")
                 # Prima verifica l'esistenza della directory
-                result = self.ssh_manager.execute_command(f"test -d '{self.nextcloud_dest_path}' && echo 'exists' || echo 'not_exists'")
+                result = self.ssh_manager.execute_command(f"test -d {self._dest_path_quoted} && echo 'exists' || echo 'not_exists'")
                 if result['exit_status'] == 0 and result['output'] == 'exists':
                     logging.info(f"   ✅ Directory destinazione esiste: {self.nextcloud_dest_path}")
                     
@@ -288,7 +493,7 @@ class NextcloudMediaSync:
                 
                 # 4. Verifica proprietà directory (www-data)
                 logging.info("4/5 Verifica proprietario directory destinazione...")
-                result = self.ssh_manager.execute_command(f"stat -c '%U' '{self.nextcloud_dest_path}' 2>/dev/null || echo 'error'")
+                result = self.ssh_manager.execute_command(f"stat -c '%U' {self._dest_path_quoted} 2>/dev/null || echo 'error'")
                 if result['exit_status'] == 0 and result['output'] != 'error':
                     owner = result['output']
                     if owner == 'www-data':
@@ -385,7 +590,8 @@ class NextcloudMediaSync:
 
     def sync_files(self):
         """Esegue la sincronizzazione completa"""
-        start_time = datetime.now()
+        # Durate misurate con l'orologio monotono: immune a cambi dell'ora di sistema
+        start_time = time.monotonic()
         
         if self.dry_run:
             logging.info("=== INIZIO DRY-RUN: SIMULAZIONE SINCRONIZZAZIONE ===")
@@ -411,6 +617,12 @@ class NextcloudMediaSync:
         
         if resumed:
             logging.info(f"Ripresa della sincronizzazione - ID sessione: {self.sync_id}")
+        elif self.skip_history and not self.resumed_from_id:
+            # Solo su richiesta: i file già elaborati in passato (per percorso o hash)
+            # non vengono ricontrollati, anche se modificati in locale o rimossi dal server
+            self.duplicate_checker.load_processed_files(self.local_source_path, self.nextcloud_dest_path)
+        
+        scan_executor = ThreadPoolExecutor(max_workers=1)
         
         try:
             # Connessione SSH (anche in dry-run per verificare connettività)
@@ -418,9 +630,19 @@ class NextcloudMediaSync:
                 self.db.update_sync_report(self.sync_id, self.report, 0, 'FAILED')
                 return False
             
+            # La scansione locale non dipende dal server: parte dopo l'autenticazione, per non
+            # scrivere sul terminale durante la richiesta della password, e procede in parallelo
+            # alla scansione remota
+            local_future = scan_executor.submit(self.get_local_files)
+            
             # Inizializza i comandi Nextcloud
             self.nextcloud_commands = NextcloudCommands(self.ssh_manager)
             
+            # Algoritmo di hash scelto in base alle capacità del server
+            if self.hash_algorithm == FileUtils.AUTO_HASH_ALGORITHM:
+                self.hash_algorithm = FileUtils.detect_remote_hash_algorithm(self.ssh_manager.get_client())
+                logging.info(f"Algoritmo hash selezionato: {self.hash_algorithm}")
+            
             # Scansiona file esistenti sul server (saltata se resuming e non dry-run)
             if not resumed or self.dry_run:
                 FileScanner.scan_remote_files(
@@ -428,47 +650,102 @@ class NextcloudMediaSync:
                     self.nextcloud_dest_path,
                     self.extensions,
                     self.duplicate_checker,
-                    self.dry_run
+                    self.dry_run,
+                    self.hash_algorithm
                 )
             else:
                 logging.info("Ripresa: skipping scansione file remoti (usando cache precedente)")
+                self.duplicate_checker.load_remote_index(self.nextcloud_dest_path, self.hash_algorithm)
             
-            # Ottiene lista file locali
-            local_files = self.get_local_files()
+            # Lista file locali (scansione avviata in parallelo)
+            local_files = local_future.result()
             if not local_files:
                 logging.warning("Nessun file multimediale trovato localmente")
                 self.db.update_sync_report(self.sync_id, self.report, 0, 'NO_FILES')
                 return True
             
+            logging.info(f"File multimediali trovati: {len(local_files)}")
+            
+            # I file già elaborati (per percorso) sono scartati in un solo passaggio, con un
+            # unico conteggio e una sola riga di log: il ciclo vede solo i file da trasferire
+            is_processed = self.duplicate_checker.is_file_already_processed
+            pending_files = [local_file for local_file in local_files if not is_processed(local_file)]
+            if len(pending_files) < len(local_files):
+                self.report.add_already_processed(len(local_files) - len(pending_files))
+                logging.info(f"File già elaborati, skipping: {len(local_files) - len(pending_files)}")
+            local_files = pending_files
+            
             logging.info(f"File da processare: {len(local_files)}")
-            if resumed and not self.dry_run:
-                estimated_remaining = len(local_files) - len(self.duplicate_checker.processed_files)
-                logging.info(f"Stima file rimanenti: {estimated_remaining}")
             
             if self.dry_run:
                 logging.info("=== INIZIO SIMULAZIONE TRASFERIMENTI ===")
+            else:
+                # Con molti file un unico flusso tar evita un round-trip SCP per file
+                self.use_tar_batches = len(local_files) >= self.TAR_MIN_FILES
+                if not self.use_tar_batches:
+                    # Pochi file: tutte le directory di destinazione con un solo comando
+                    self.ssh_manager.ensure_remote_directories(
+                        posixpath.dirname(posixpath.join(
+                            self._dest_path_str, FileUtils.get_relative_path(local_file, self.local_source_path)
+                        ))
+                        for local_file in local_files
+                    )
+            
+            # Trasferisce ogni file. Metodi e costanti usati a ogni iterazione sono
+            # risolti una volta sola in variabili locali
+            transfer_file = self.transfer_file
+            prehash_files = self._prehash_files
+            transfer_batch_full = self._transfer_batch_full
+            flush_transfer_batch = self._flush_transfer_batch
+            flush_database = self.db.flush
+            log_debug = logging.debug
+            monotonic = time.monotonic
+            total_files = len(local_files)
+            hash_prefetch = self.HASH_PREFETCH
+            flush_every = self.db.FLUSH_EVERY
+            progress_interval = self.PROGRESS_LOG_INTERVAL
+            dry_run = self.dry_run
+            file_message = "[DRY-RUN] Processando file %d/%d: %s" if dry_run else "Processando file %d/%d: %s"
             
-            # Trasferisce ogni file
+            last_log_time = monotonic()
+            last_log_index = 0
             try:
                 for i, local_file in enumerate(local_files, 1):
-                    if self.dry_run:
-                        logging.info(f"[DRY-RUN] Processando file {i}/{len(local_files)}: {local_file}")
-                    else:
-                        logging.info(f"Processando file {i}/{len(local_files)}: {local_file}")
+                    # Gli hash del blocco successivo sono calcolati su più core
+                    if (i - 1) % hash_prefetch == 0:
+                        prehash_files(local_files[i - 1:i - 1 + hash_prefetch])
+                    
+                    # Riga per file solo in debug: formattata soltanto se il livello è attivo
+                    log_debug(file_message, i, total_files, local_file)
+                    
+                    transfer_file(local_file)
+                    
+                    # Il blocco pieno parte qui, fuori dalla gestione errori del singolo file
+                    if transfer_batch_full():
+                        flush_transfer_batch()
                     
-                    self.transfer_file(local_file)
+                    # Salva progresso con un'unica transazione per blocco di file (non in dry-run)
+                    if i % flush_every == 0 and not dry_run:
+                        flush_database()
                     
-                    # Salva progresso ogni 10 file (non in dry-run)
-                    if i % 10 == 0 and not self.dry_run:
-                        logging.info(f"Progresso salvato: {i}/{len(local_files)} file processati")
+                    # Avanzamento a intervalli di tempo, indipendente dalla dimensione dei file
+                    now = monotonic()
+                    if now - last_log_time >= progress_interval:
+                        rate = (i - last_log_index) / (now - last_log_time)
+                        logging.info(f"Avanzamento: {i}/{total_files} file processati ({rate:.1f} file/s)")
+                        last_log_time, last_log_index = now, i
+                
+                flush_transfer_batch()
                         
             except KeyboardInterrupt:
+                # I file ancora in coda non risultano trasferiti: saranno ripresi al riavvio
+                self._transfer_batch = []
                 if self.dry_run:
                     logging.warning("[DRY-RUN] Simulazione interrotta dall'utente")
                 else:
                     logging.warning("Sincronizzazione interrotta dall'utente")
                     self.db.update_sync_report(self.sync_id, self.report, 
-                                             (datetime.now() - start_time).total_seconds(), 
+                                             time.monotonic() - start_time, 
                                              'INTERRUPTED')
                     print(f"\nSincronizzazione interrotta. Progresso salvato nel database (ID: {self.sync_id})")
                     print("Riavvia lo script per continuare da dove si era fermato.")
@@ -476,7 +753,9 @@ class NextcloudMediaSync:
             
             # Comandi post-sincronizzazione
             if self.report.files_transferred > 0 or self.report.duplicates_renamed > 0 or self.dry_run:
-                self.nextcloud_commands.execute_post_sync_commands(self.nextcloud_dest_path, self.dry_run)
+                self.nextcloud_commands.execute_post_sync_commands(
+                    self.nextcloud_dest_path, self.dry_run, touched_paths=self._touched_remote_paths()
+                )
             
         except Exception as e:
             logging.error(f"Errore generale durante sincronizzazione: {e}")
@@ -485,14 +764,21 @@ class NextcloudMediaSync:
                 self.db.log_error(self.sync_id, f"Errore generale: {e}")
             
         finally:
+            scan_executor.shutdown(wait=False, cancel_futures=True)
+            if self._upload_executor is not None:
+                self._upload_executor.shutdown(cancel_futures=True)
+                self._upload_executor = None
             self.ssh_manager.disconnect()
+            
+            # Il buffer del log (MemoryHandler) arriva su disco a fine sincronizzazione
+            for handler in logging.getLogger().handlers:
+                handler.flush()
         
         # Aggiorna report nel database
-        end_time = datetime.now()
-        duration = end_time - start_time
-        duration_seconds = duration.total_seconds()
+        duration_seconds = time.monotonic() - start_time
+        duration = timedelta(seconds=duration_seconds)
         
-        status = 'DRY_RUN_COMPLETED' if self.dry_run else ('COMPLETED' if len(self.report.errors) == 0 else 'COMPLETED_WITH_ERRORS')
+        status = 'DRY_RUN_COMPLETED' if self.dry_run else ('COMPLETED' if self.report.error_count == 0 else 'COMPLETED_WITH_ERRORS')
         self.db.update_sync_report(self.sync_id, self.report, duration_seconds, status)
         
         # Stampa report finale
@@ -504,4 +790,4 @@ class NextcloudMediaSync:
             self.dry_run
         )
         
-        return len(self.report.errors) == 0
\ No newline at end of file
+        return self.report.error_count == 0
\ No newline at end of file
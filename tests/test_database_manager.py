@@ -0,0 +1,168 @@
+"""
+Test del DatabaseManager
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from database_manager import DatabaseManager
+
+# Schema originale (user_version 0): solo report, file trasferiti ed errori
+LEGACY_SCHEMA = '''
+    CREATE TABLE sync_reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sync_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        files_transferred INTEGER DEFAULT 0,
+        duplicates_found INTEGER DEFAULT 0,
+        duplicates_renamed INTEGER DEFAULT 0,
+        errors_count INTEGER DEFAULT 0,
+        skipped_files INTEGER DEFAULT 0,
+        already_processed INTEGER DEFAULT 0,
+        total_size_bytes INTEGER DEFAULT 0,
+        duration_seconds REAL,
+        source_path TEXT,
+        dest_path TEXT,
+        status TEXT,
+        resumed_from_id INTEGER
+    );
+    CREATE TABLE transferred_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sync_id INTEGER,
+        source_file TEXT,
+        dest_file TEXT,
+        file_hash TEXT,
+        file_size INTEGER,
+        transfer_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_duplicate BOOLEAN DEFAULT FALSE,
+        processing_status TEXT DEFAULT 'COMPLETED',
+        FOREIGN KEY (sync_id) REFERENCES sync_reports (id)
+    );
+    CREATE TABLE sync_errors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sync_id INTEGER,
+        error_message TEXT,
+        file_path TEXT,
+        error_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (sync_id) REFERENCES sync_reports (id)
+    );
+'''
+
+class DatabaseTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'sync.db')
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def open_raw(self):
+        conn = sqlite3.connect(self.db_path)
+        self.addCleanup(conn.close)
+        return conn
+
+class SchemaMigrationTest(DatabaseTestCase):
+    
+    def test_migrates_legacy_database(self):
+        conn = self.open_raw()
+        conn.executescript(LEGACY_SCHEMA)
+        conn.execute("INSERT INTO sync_reports (source_path, dest_path, status) VALUES ('/src', '/dst', 'COMPLETED')")
+        conn.execute("INSERT INTO transferred_files (sync_id, source_file, file_hash) VALUES (1, '/src/a.jpg', 'h1')")
+        conn.commit()
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], 0)
+        conn.close()
+        
+        db = DatabaseManager(self.db_path)
+        self.addCleanup(db.close)
+        
+        conn = self.open_raw()
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], DatabaseManager.SCHEMA_VERSION)
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+        for name in ('file_hash_cache', 'remote_hashes', 'remote_file_index',
+                     'idx_reports_paths_status', 'idx_tf_sync_status', 'idx_tf_source',
+                     'idx_errors_sync', 'idx_reports_date'):
+            self.assertIn(name, names)
+        
+        # I dati esistenti restano leggibili
+        self.assertEqual(db.get_all_previous_processed_files('/src', '/dst'), {'/src/a.jpg': 'h1'})
+    
+    def test_rebuilds_old_remote_index(self):
+        conn = self.open_raw()
+        conn.executescript(LEGACY_SCHEMA)
+        conn.execute('''
+            CREATE TABLE remote_file_index (
+                dest_path TEXT, algorithm TEXT, remote_path TEXT, file_hash TEXT,
+                PRIMARY KEY (dest_path, algorithm, remote_path)
+            )
+        ''')
+        conn.execute("INSERT INTO remote_file_index VALUES ('/dst', 'md5', '/dst/a.jpg', 'h1')")
+        conn.execute('PRAGMA user_version = 4')
+        conn.commit()
+        conn.close()
+        
+        db = DatabaseManager(self.db_path)
+        self.addCleanup(db.close)
+        
+        self.assertEqual(db.get_remote_index('/dst', 'md5'), [])
+        db.add_remote_index_entry('/dst', 'md5', '/dst/a.jpg', 'h1', 10, '1700000000.0')
+        self.assertEqual(db.get_remote_index('/dst', 'md5'), [('/dst/a.jpg', 'h1', 10, '1700000000.0')])
+    
+    def test_reopening_current_schema_is_noop(self):
+        DatabaseManager(self.db_path).close()
+        db = DatabaseManager(self.db_path)
+        self.addCleanup(db.close)
+        self.assertEqual(
+            db.conn.execute('PRAGMA user_version').fetchone()[0], DatabaseManager.SCHEMA_VERSION
+        )
+
+class QueryTest(DatabaseTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.db = DatabaseManager(self.db_path)
+        self.addCleanup(self.db.close)
+    
+    def test_processed_files_beyond_parameter_limit(self):
+        sync_ids = [self.db.start_sync_session('/src', '/dst') for _ in range(DatabaseManager.MAX_QUERY_PARAMS + 20)]
+        for sync_id in sync_ids:
+            self.db.log_transferred_file(sync_id, f'/src/{sync_id}.jpg', f'/dst/{sync_id}.jpg', 'h', 1)
+        self.db.log_transferred_file(sync_ids[0], '/src/parziale.jpg', '', 'h', 1, status='INTERRUPTED')
+        
+        processed = self.db.get_processed_files(sync_ids)
+        self.assertEqual(processed, {f'/src/{sync_id}.jpg' for sync_id in sync_ids})
+    
+    def test_remote_index_is_scoped_by_destination_and_algorithm(self):
+        self.db.add_remote_index_entry('/dst', 'md5', '/dst/a.jpg', 'h1', 1, '1.0')
+        self.db.add_remote_index_entry('/dst', 'blake3', '/dst/a.jpg', 'b3:h1', 1, '1.0')
+        self.db.add_remote_index_entry('/altro', 'md5', '/altro/b.jpg', 'h2')
+        
+        self.assertEqual(self.db.get_remote_index('/dst', 'md5'), [('/dst/a.jpg', 'h1', 1, '1.0')])
+        
+        self.db.replace_remote_index('/dst', 'md5', [])
+        self.assertEqual(self.db.get_remote_index('/dst', 'md5'), [])
+        self.assertEqual(len(self.db.get_remote_index('/dst', 'blake3')), 1)
+        self.assertEqual(self.db.get_remote_index('/altro', 'md5'), [('/altro/b.jpg', 'h2', None, None)])
+    
+    def test_replace_remote_index(self):
+        self.db.add_remote_index_entry('/dst', 'md5', '/dst/vecchio.jpg', 'h0', 1, '1')
+        self.db.add_remote_index_entry('/altro', 'md5', '/altro/b.jpg', 'h2')
+        
+        self.db.replace_remote_index('/dst', 'md5', [('/dst/a.jpg', 'h1', 10, '1700000000')])
+        self.assertEqual(self.db.get_remote_index('/dst', 'md5'), [('/dst/a.jpg', 'h1', 10, '1700000000')])
+        self.assertEqual(len(self.db.get_remote_index('/altro', 'md5')), 1)
+    
+    def test_failed_replace_keeps_remote_index(self):
+        self.db.add_remote_index_entry('/dst', 'md5', '/dst/a.jpg', 'h1', 10, '1700000000')
+        
+        def entries():
+            yield ('/dst/b.jpg', 'h2', 20, '1700000001')
+            raise OSError('scansione interrotta')
+        
+        with self.assertRaises(OSError):
+            self.db.replace_remote_index('/dst', 'md5', entries())
+        self.assertEqual(self.db.get_remote_index('/dst', 'md5'), [('/dst/a.jpg', 'h1', 10, '1700000000')])
+
+if __name__ == '__main__':
+    unittest.main()
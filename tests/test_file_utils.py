@@ -0,0 +1,285 @@
+"""
+Test delle utilità di file_utils
+"""
+
+import io
+import threading
+import unittest
+
+from database_manager import DatabaseManager
+from file_utils import BloomFilter, DuplicateChecker, FileScanner, FileUtils, ScalableBloomFilter
+
+class _ProbeOutput:
+    """Stdout di un comando remoto con una risposta fissa"""
+    
+    def __init__(self, text):
+        self.text = text
+    
+    def read(self):
+        return self.text.encode()
+
+class _ProbeClient:
+    """Client SSH minimo: risponde ai test -f dicendo esistente per i percorsi indicati"""
+    
+    def __init__(self, existing=()):
+        self.existing = set(existing)
+        self.commands = []
+    
+    def exec_command(self, command):
+        self.commands.append(command)
+        exists = any(path in command for path in self.existing)
+        return None, _ProbeOutput('exists' if exists else 'not_exists'), None
+
+class _ScanChannel:
+    """Canale di un comando remoto: raccoglie lo stdin e ne ricava lo stdout alla chiusura"""
+    
+    def __init__(self, respond):
+        self.channel = self
+        self.respond = respond
+        self.input = b''
+        self.input_closed = threading.Event()
+        self.output = None
+    
+    def sendall(self, data):
+        self.input += data
+    
+    def shutdown_write(self):
+        self.input_closed.set()
+    
+    def recv_exit_status(self):
+        return 0
+    
+    def read(self, size=-1):
+        if self.output is None:
+            self.input_closed.wait(5)
+            self.output = io.BytesIO(self.respond(self.input))
+        return self.output.read(size)
+
+class _ScanClient:
+    """Client SSH minimo per la scansione: file remoti fissi {percorso: (dimensione, mtime, hash)}"""
+    
+    def __init__(self, files, disconnect_on_hash=False):
+        self.files = files
+        self.disconnect_on_hash = disconnect_on_hash
+        self.hashed = []
+    
+    def exec_command(self, command):
+        channel = _ScanChannel(lambda data: self.respond(command, data))
+        if not command.startswith('xargs'):
+            channel.shutdown_write()
+        return channel, channel, io.BytesIO()
+    
+    def respond(self, command, data):
+        if 'find' in command:
+            return b''.join(b'%d\t%s\t%s\0' % (size, mtime, path) for path, (size, mtime, _) in self.files.items())
+        if command.startswith('xargs'):
+            if self.disconnect_on_hash:
+                raise EOFError('connessione chiusa')
+            paths = data.split(b'\0')
+            self.hashed.extend(paths)
+            return b''.join(b'%s  %s\n' % (self.files[path][2], path) for path in paths)
+        return b''
+
+class ParseChecksumLineTest(unittest.TestCase):
+    
+    def test_plain_line(self):
+        line = "d41d8cd98f00b204e9800998ecf8427e  /data/foto/a.jpg\n"
+        self.assertEqual(
+            FileUtils.parse_checksum_line(line),
+            ("d41d8cd98f00b204e9800998ecf8427e", "/data/foto/a.jpg")
+        )
+    
+    def test_path_with_double_space(self):
+        line = "abc123  /data/due  spazi.jpg"
+        self.assertEqual(FileUtils.parse_checksum_line(line), ("abc123", "/data/due  spazi.jpg"))
+    
+    def test_escaped_newline_and_backslash(self):
+        line = "\\abc123  /data/riga\\nnuova\\\\x.jpg\n"
+        self.assertEqual(FileUtils.parse_checksum_line(line), ("abc123", "/data/riga\nnuova\\x.jpg"))
+    
+    def test_empty_and_malformed_lines(self):
+        self.assertEqual(FileUtils.parse_checksum_line("\n"), (None, None))
+        self.assertEqual(FileUtils.parse_checksum_line("solohash"), (None, None))
+
+class IterNullRecordsTest(unittest.TestCase):
+    
+    def test_records_split_across_reads(self):
+        stream = io.BytesIO(b"primo\0secondo record\0terzo")
+        records = list(FileScanner.iter_null_records(stream, bufsize=4))
+        self.assertEqual(records, [b"primo", b"secondo record", b"terzo"])
+    
+    def test_trailing_separator_and_empty_stream(self):
+        self.assertEqual(list(FileScanner.iter_null_records(io.BytesIO(b"a\0b\0"))), [b"a", b"b"])
+        self.assertEqual(list(FileScanner.iter_null_records(io.BytesIO(b""))), [])
+    
+    def test_non_utf8_bytes_are_kept(self):
+        records = list(FileScanner.iter_null_records(io.BytesIO(b"bad\xff\xfe.jpg\0")))
+        self.assertEqual(records, [b"bad\xff\xfe.jpg"])
+        self.assertEqual(FileScanner.decode_remote_path(records[0]), "bad��.jpg")
+    
+    def test_line_separator(self):
+        stream = io.BytesIO(b"h1  a.jpg\nh2  b.jpg\n")
+        records = list(FileScanner.iter_null_records(stream, bufsize=3, separator=b"\n"))
+        self.assertEqual(records, [b"h1  a.jpg", b"h2  b.jpg"])
+
+class BloomFilterTest(unittest.TestCase):
+    
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        items = [f"/foto/{i}.jpg" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+    
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"/foto/{i}.jpg")
+        false_positives = sum(f"/altro/{i}.jpg" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+    
+    def test_surrogate_escaped_paths(self):
+        bloom = BloomFilter(10)
+        bloom.add("bad\udcff.jpg")
+        self.assertIn("bad\udcff.jpg", bloom)
+    
+    def test_scalable_filter_grows(self):
+        bloom = ScalableBloomFilter(100, 0.01)
+        items = [f"hash{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertGreater(len(bloom.filters), 1)
+        self.assertTrue(all(item in bloom for item in items))
+
+class DuplicateCheckerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.db = DatabaseManager(':memory:')
+        self.addCleanup(self.db.close)
+        sync_id = self.db.start_sync_session('/src', '/dst')
+        self.db.log_transferred_file(sync_id, '/src/a.jpg', '/dst/a.jpg', 'hash-a', 1)
+        self.db.log_transferred_file(sync_id, '/src/b.jpg', '', 'hash-b', 1, status='INTERRUPTED')
+        self.checker = DuplicateChecker(self.db)
+        self.checker.load_processed_files('/src', '/dst')
+    
+    def test_path_already_processed(self):
+        self.assertTrue(self.checker.is_file_already_processed('/src/a.jpg'))
+        self.assertFalse(self.checker.is_file_already_processed('/src/b.jpg'))
+    
+    def test_processed_paths_kept_as_digests(self):
+        self.assertEqual(self.checker.processed_files, {DuplicateChecker.path_digest('/src/a.jpg')})
+        self.assertLess(DuplicateChecker.path_digest('/src/a.jpg'), 2 ** 64)
+        self.assertIsInstance(DuplicateChecker.path_digest('bad\udcff.jpg'), int)
+    
+    def test_digest_hit_is_verified_on_database(self):
+        # Una collisione del digest non basta: il percorso deve risultare completato sul database
+        self.checker.processed_files.add(DuplicateChecker.path_digest('/src/collisione.jpg'))
+        self.assertFalse(self.checker.is_file_already_processed('/src/collisione.jpg'))
+    
+    def test_interrupted_files(self):
+        sync_id = self.db.start_sync_session('/src', '/dst')
+        self.db.log_transferred_file(sync_id, '/src/ripreso.jpg', '/dst/ripreso.jpg', 'hash-r', 1)
+        checker = DuplicateChecker(self.db)
+        checker.load_interrupted_files([sync_id])
+        self.assertTrue(checker.is_file_already_processed('/src/ripreso.jpg'))
+        self.assertFalse(checker.is_file_already_processed('/src/a.jpg'))
+    
+    def test_hash_of_processed_file_on_new_path(self):
+        self.assertTrue(self.checker.is_file_already_processed('/src/copia.jpg', 'hash-a'))
+        self.assertFalse(self.checker.is_file_already_processed('/src/copia.jpg', 'hash-b'))
+        self.assertFalse(self.checker.is_file_already_processed('/src/copia.jpg'))
+    
+    def test_remote_hashes_are_not_processed_files(self):
+        # Un contenuto già sul server deve arrivare alla rinomina _DUP_, non essere saltato
+        self.checker.add_remote_file_hash('hash-remoto', '/dst/x.jpg')
+        self.assertFalse(self.checker.is_file_already_processed('/src/x.jpg', 'hash-remoto'))
+        self.assertTrue(self.checker.is_duplicate_in_remote('hash-remoto'))
+    
+    def test_remote_hashes_spill_to_database(self):
+        self.checker.BLOOM_THRESHOLD = 10
+        for i in range(25):
+            self.checker.add_remote_file_hash(f'hash{i}', f'/dst/{i}.jpg')
+        
+        self.assertIsNotNone(self.checker.remote_bloom)
+        self.assertEqual(self.checker.remote_file_hashes, {})
+        self.assertEqual(self.checker.get_existing_duplicate_path('hash3'), '/dst/3.jpg')
+        self.assertEqual(self.checker.get_existing_duplicate_path('hash24'), '/dst/24.jpg')
+        self.assertFalse(self.checker.is_duplicate_in_remote('nuovo'))
+        
+        self.checker.resolve_remote_hashes(['hash5', 'nuovo'])
+        self.checker.discard_remote_file_hash('hash5')
+        self.assertFalse(self.checker.is_duplicate_in_remote('hash5'))
+
+class GenerateDuplicateNameTest(unittest.TestCase):
+    
+    def test_content_addressed_name(self):
+        file_hash = "9e107d9d372bb6826bd81d3542a419d6"
+        new_path = FileUtils.generate_duplicate_name(_ProbeClient(), "/dest/a/IMG001.jpg", file_hash=file_hash)
+        self.assertEqual(new_path, "/dest/a/IMG001_DUP_9e107d9d372bb682.jpg")
+    
+    def test_algorithm_prefix_is_dropped(self):
+        new_path = FileUtils.generate_duplicate_name(
+            _ProbeClient(), "/dest/video.mp4", file_hash="b3:0123456789abcdef0123"
+        )
+        self.assertEqual(new_path, "/dest/video_DUP_0123456789abcdef.mp4")
+    
+    def test_content_name_does_not_probe_server(self):
+        client = _ProbeClient()
+        FileUtils.generate_duplicate_name(client, "/dest/a.jpg", file_hash="ab" * 16)
+        self.assertEqual(client.commands, [])
+    
+    def test_reserved_name_falls_back_to_probe(self):
+        file_hash = "ab" * 16
+        reserved = {f"/dest/a_DUP_{file_hash[:16]}.jpg", "/dest/a_DUP.jpg"}
+        client = _ProbeClient(existing=["/dest/a_DUP2.jpg"])
+        new_path = FileUtils.generate_duplicate_name(client, "/dest/a.jpg", reserved=reserved, file_hash=file_hash)
+        self.assertEqual(new_path, "/dest/a_DUP3.jpg")
+    
+    def test_dry_run_without_hash(self):
+        self.assertEqual(FileUtils.generate_duplicate_name(None, "/dest/a.jpg", dry_run=True), "/dest/a_DUP.jpg")
+
+class ScanRemoteFilesTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.db = DatabaseManager(':memory:')
+        self.addCleanup(self.db.close)
+        self.files = {
+            b'/dst/a.jpg': (1, b'1700000000.25', b'hash-a'),
+            b'/dst/b.jpg': (2, b'1700000001.5', b'hash-b'),
+        }
+    
+    def scan(self, disconnect_on_hash=False):
+        client = _ScanClient(self.files, disconnect_on_hash)
+        checker = DuplicateChecker(self.db)
+        FileScanner.scan_remote_files(client, '/dst', ['.jpg'], checker, hash_algorithm='md5')
+        return client, checker
+    
+    def test_unchanged_files_are_not_rehashed(self):
+        client, _ = self.scan()
+        self.assertEqual(sorted(client.hashed), [b'/dst/a.jpg', b'/dst/b.jpg'])
+        self.assertIn(('/dst/a.jpg', 'hash-a', 1, '1700000000'), self.db.get_remote_index('/dst', 'md5'))
+        
+        self.files[b'/dst/b.jpg'] = (2, b'1700000009.0', b'hash-b2')
+        client, checker = self.scan()
+        self.assertEqual(client.hashed, [b'/dst/b.jpg'])
+        self.assertEqual(checker.get_existing_duplicate_path('hash-a'), '/dst/a.jpg')
+        self.assertTrue(checker.is_duplicate_in_remote('hash-b2'))
+        self.assertFalse(checker.is_duplicate_in_remote('hash-b'))
+    
+    def test_uploaded_file_is_reused(self):
+        # Voce scritta dopo un caricamento: dimensione e mtime in secondi interi
+        self.db.add_remote_index_entry('/dst', 'md5', '/dst/a.jpg', 'hash-a', 1, '1700000000')
+        client, _ = self.scan()
+        self.assertEqual(client.hashed, [b'/dst/b.jpg'])
+    
+    def test_failed_scan_keeps_previous_index(self):
+        self.scan()
+        previous = sorted(self.db.get_remote_index('/dst', 'md5'))
+        
+        self.files[b'/dst/b.jpg'] = (2, b'1700000009.0', b'hash-b2')
+        with self.assertLogs(level='ERROR'), self.assertRaises(EOFError):
+            self.scan(disconnect_on_hash=True)
+        self.assertEqual(sorted(self.db.get_remote_index('/dst', 'md5')), previous)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Test dei comandi Nextcloud con un SSHManager senza rete
+"""
+
+import os
+import stat
+import subprocess
+import tempfile
+import unittest
+
+from ssh_manager import NextcloudCommands
+
+class _LocalSSHManager:
+    """SSHManager minimo: esegue i comandi con la shell locale e li registra"""
+    
+    def __init__(self):
+        self.commands = []
+    
+    def execute_command(self, command, timeout=300, input_data=None):
+        self.commands.append((command, input_data))
+        result = subprocess.run(command, shell=True, input=input_data, capture_output=True, timeout=timeout)
+        return {
+            'exit_status': result.returncode,
+            'output': result.stdout.decode(errors='replace').strip(),
+            'error': result.stderr.decode(errors='replace').strip()
+        }
+
+class SetPermissionsOnPathsTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.ssh_manager = _LocalSSHManager()
+        self.commands = NextcloudCommands(self.ssh_manager)
+        # Proprietario attuale: chown riesce anche senza privilegi
+        self.owner, self.group = str(os.getuid()), str(os.getgid())
+    
+    def make_file(self, name, mode=0o600):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'wb'):
+            pass
+        os.chmod(path, mode)
+        return path
+    
+    def mode(self, path):
+        return stat.S_IMODE(os.stat(path).st_mode)
+    
+    def test_only_given_paths_are_changed(self):
+        touched = self.make_file('nuovo.jpg')
+        untouched = self.make_file('vecchio.jpg')
+        directory = os.path.join(self.tmpdir.name, 'album')
+        os.mkdir(directory, 0o700)
+        
+        self.assertTrue(self.commands.set_permissions(
+            self.tmpdir.name, self.owner, self.group, paths=[touched, directory]
+        ))
+        self.assertEqual(self.mode(touched), 0o644)
+        self.assertEqual(self.mode(directory), 0o755)
+        self.assertEqual(self.mode(untouched), 0o600)
+        self.assertEqual(len(self.ssh_manager.commands), 1)
+    
+    def test_non_utf8_name(self):
+        # Nome con un byte non UTF-8, come arriva dalla scansione (surrogateescape)
+        raw_path = os.path.join(os.fsencode(self.tmpdir.name), b'foto\xff.jpg')
+        with open(raw_path, 'wb'):
+            pass
+        os.chmod(raw_path, 0o600)
+        path = os.fsdecode(raw_path)
+        
+        self.assertTrue(self.commands.set_permissions(self.tmpdir.name, self.owner, self.group, paths=[path]))
+        self.assertEqual(self.ssh_manager.commands[0][1], raw_path)
+        self.assertEqual(self.mode(raw_path), 0o644)
+    
+    def test_missing_path_reports_failure(self):
+        missing = os.path.join(self.tmpdir.name, 'sparito.jpg')
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(self.commands.set_permissions(
+                self.tmpdir.name, self.owner, self.group, paths=[missing]
+            ))
+    
+    def test_dry_run_runs_nothing(self):
+        self.assertTrue(self.commands.set_permissions(self.tmpdir.name, dry_run=True, paths=['/x']))
+        self.assertEqual(self.ssh_manager.commands, [])
+
+if __name__ == '__main__':
+    unittest.main()
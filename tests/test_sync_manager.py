@@ -0,0 +1,106 @@
+"""
+Test del NextcloudMediaSync con un SSHManager senza rete
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sync_manager import NextcloudMediaSync
+
+class _StubSSHManager:
+    """SSHManager minimo: registra i trasferimenti e ne simula l'esito"""
+    
+    def __init__(self, tar_result=True, failing_uploads=(), mkdir_error=None):
+        self.tar_result = tar_result
+        self.failing_uploads = set(failing_uploads)
+        self.mkdir_error = mkdir_error
+        self.tar_batches = []
+        self.uploads = []
+    
+    def transfer_files_as_tar(self, files, remote_root):
+        self.tar_batches.append(list(files))
+        return self.tar_result
+    
+    def ensure_remote_directories(self, remote_dirs, batch_size=500):
+        list(remote_dirs)
+        if self.mkdir_error:
+            raise self.mkdir_error
+    
+    def transfer_file_as_www_data(self, local_path, remote_path):
+        self.uploads.append(remote_path)
+        return remote_path not in self.failing_uploads
+
+class TransferBatchTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        
+        with mock.patch.object(NextcloudMediaSync, '_setup_logging'):
+            self.sync = NextcloudMediaSync(
+                'host', 'root', '/dst', self.tmpdir.name, db_path=':memory:', hash_algorithm='md5'
+            )
+        self.addCleanup(self.sync.db.close)
+        self.addCleanup(lambda: self.sync._upload_executor and self.sync._upload_executor.shutdown())
+        self.sync.sync_id = self.sync.db.start_sync_session(self.tmpdir.name, '/dst')
+        self.sync.use_tar_batches = True
+        
+        # Tre file in coda, come dopo il controllo duplicati
+        for i in range(3):
+            local_path = os.path.join(self.tmpdir.name, f'{i}.jpg')
+            with open(local_path, 'wb') as f:
+                f.write(b'x' * (i + 1))
+            self.sync._queue_transfer(local_path, f'/dst/{i}.jpg', f'hash{i}', i + 1, False)
+    
+    def logged_errors(self):
+        self.sync.db.flush()
+        return [row[0] for row in self.sync.db.conn.execute('SELECT file_path FROM sync_errors ORDER BY file_path')]
+    
+    def test_tar_batch(self):
+        self.sync.ssh_manager = _StubSSHManager()
+        self.sync._flush_transfer_batch()
+        
+        self.assertEqual(len(self.sync.ssh_manager.tar_batches), 1)
+        self.assertEqual(self.sync.ssh_manager.uploads, [])
+        self.assertEqual(self.sync.report.files_transferred, 3)
+        self.assertEqual(self.sync.report.error_count, 0)
+        self.assertEqual(self.sync._transfer_batch, [])
+        self.assertEqual(len(self.sync.db.get_remote_index('/dst', 'md5')), 3)
+    
+    def test_tar_failure_falls_back_to_sftp(self):
+        self.sync.ssh_manager = _StubSSHManager(tar_result=False, failing_uploads=['/dst/1.jpg'])
+        with self.assertLogs(level='WARNING'):
+            self.sync._flush_transfer_batch()
+        
+        self.assertEqual(sorted(self.sync.ssh_manager.uploads), ['/dst/0.jpg', '/dst/1.jpg', '/dst/2.jpg'])
+        self.assertEqual(self.sync.report.files_transferred, 2)
+        self.assertEqual(self.sync.report.error_count, 1)
+        self.assertEqual(self.sync.report.skipped_files, 1)
+        self.assertEqual(self.logged_errors(), [os.path.join(self.tmpdir.name, '1.jpg')])
+        
+        # Il contenuto mancante non deve far rinominare come duplicato i file successivi
+        self.assertFalse(self.sync.duplicate_checker.is_duplicate_in_remote('hash1'))
+        self.assertTrue(self.sync.duplicate_checker.is_duplicate_in_remote('hash0'))
+    
+    def test_connection_error_fails_whole_batch(self):
+        self.sync.ssh_manager = _StubSSHManager(tar_result=False, mkdir_error=ConnectionError('connessione persa'))
+        with self.assertLogs(level='ERROR'):
+            self.sync._flush_transfer_batch()
+        
+        self.assertEqual(self.sync.ssh_manager.uploads, [])
+        self.assertEqual(self.sync.report.files_transferred, 0)
+        self.assertEqual(self.sync.report.error_count, 3)
+        self.assertEqual(self.sync.report.skipped_files, 3)
+        self.assertEqual(len(self.logged_errors()), 3)
+        for i in range(3):
+            self.assertFalse(self.sync.duplicate_checker.is_duplicate_in_remote(f'hash{i}'))
+    
+    def test_full_batch_is_detected(self):
+        self.assertFalse(self.sync._transfer_batch_full())
+        self.sync.TAR_BATCH_FILES = 3
+        self.assertTrue(self.sync._transfer_batch_full())
+
+if __name__ == '__main__':
+    unittest.main()